@@ -1,54 +1,96 @@
-from flask import Flask, request, render_template, send_file, session, redirect, url_for
+from flask import Blueprint, Flask, Response, current_app, g, request, render_template, session, url_for, jsonify
 from werkzeug.utils import secure_filename
-from transform import transform_excel
 from config import Config
+from db import get_pool, PoolTimeout, count_existing, count_partition_rows, ensure_schema, replace_partitions, normalize_types, partitions
+from queries import QueryError, list_egresos, aggregate_egresos, result_cache
+from registry import calculate_dataframe_hash, ensure_registry, find_by_hash, register_load, list_loads, delete_load
+from summaries import ensure_summaries, update_summaries
+from jobs import configure_pools, create_job, get_job, submit_process, submit_thread, job_folder, cleanup_job_folders
+from instrumentation import configure_logging, phase_timer, timed_stream, render_metrics, RequestProfiler, HTTP_REQUESTS, HTTP_SECONDS, POOL
+import importlib
+import logging
+import time
+import uuid
 import os
-from io import BytesIO
-import pyodbc
-import pandas as pd
-import hashlib
-import warnings
 from datetime import datetime
 
-# Suprimir advertencias
-warnings.filterwarnings('ignore')
-
-# Inicializar Flask
-app = Flask(__name__, template_folder='templates')
-app.config.from_object(Config)
-
-# Crear directorios si no existen
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-if not os.path.exists(app.config['TRANSFORMED_FOLDER']):
-    os.makedirs(app.config['TRANSFORMED_FOLDER'])
+# pandas, openpyxl y los módulos que los usan (transform, export, batch) se importan
+# dentro de las rutas y tareas que transforman o cargan archivos, no al iniciar la aplicación
+HEAVY_MODULES = ['pandas', 'openpyxl', 'transform', 'export', 'batch']
+
+logger = logging.getLogger(__name__)
+
+# Rutas de la aplicación; create_app las registra
+bp = Blueprint('main', __name__)
+
+# Crear la aplicación Flask (flask --app app run, o gunicorn 'app:create_app()').
+# Configura los logs y las carpetas; los pools de trabajos se crean con el primer trabajo.
+def create_app(config_object=Config):
+    app = Flask(__name__, template_folder='templates')
+    app.config.from_object(config_object)
+
+    # Logs estructurados (reemplazan los print de depuración)
+    configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
+
+    # Crear directorios si no existen
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['TRANSFORMED_FOLDER'], exist_ok=True)
+
+    # Pools de trabajos en segundo plano: procesos para transformar, hilos para la base de datos
+    configure_pools(app.config['JOB_PROCESSES'], app.config['JOB_THREADS'])
+
+    app.register_blueprint(bp)
+    return app
+
+# Importar los módulos pesados una sola vez en el proceso maestro de gunicorn (ver wsgi.py):
+# el worker los hereda ya cargados y su primera transformación no paga la importación. Devuelve los segundos de cada módulo.
+def warmup():
+    tiempos = {}
+    for name in HEAVY_MODULES:
+        inicio = time.perf_counter()
+        importlib.import_module(name)
+        tiempos[name] = round(time.perf_counter() - inicio, 4)
+    logger.info('módulos precargados', extra={'seconds': tiempos})
+    return tiempos
+
+# Conexión a la base de datos de la solicitud actual, sacada del pool en el primer uso
+def get_db():
+    if 'db_conn' not in g:
+        g.db_pool = get_pool(current_app.config)
+        g.db_conn = g.db_pool.acquire()
+    return g.db_conn
+
+# Devolver la conexión al pool al terminar la solicitud
+@bp.teardown_app_request
+def release_db(exception):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        g.db_pool.release(conn)
+
+# Medir cada solicitud (y perfilarla con PROFILE_REQUESTS)
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if current_app.config['PROFILE_REQUESTS']:
+        g.profiler = RequestProfiler(current_app.config['PROFILE_FOLDER'])
+        g.profiler.start()
+
+@bp.after_app_request
+def record_request(response):
+    endpoint = request.endpoint or 'sin_ruta'
+    seconds = time.perf_counter() - g.pop('request_start', time.perf_counter())
+    HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    HTTP_SECONDS.observe(seconds, endpoint=endpoint)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        logger.info('perfil guardado', extra={'endpoint': endpoint, 'path': profiler.stop(endpoint)})
+    logger.debug('solicitud', extra={'method': request.method, 'path': request.path, 'status': response.status_code,
+                                     'seconds': round(seconds, 4)})
+    return response
 
 # Verificar extensión del archivo
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
-
-# Función para crear o recrear la tabla egresos
-def create_or_recreate_table(df, conn):
-    cursor = conn.cursor()
-    # Dropear la tabla si existe
-    cursor.execute("IF OBJECT_ID('egresos', 'U') IS NOT NULL DROP TABLE egresos")
-    print("Tabla egresos dropeada o no existía.")
-    columns = []
-    for column in df.columns:
-        if column == 'totalest':
-            sql_type = 'NVARCHAR(100)'
-        else:
-            sql_type = 'NVARCHAR(255)'  # Usar NVARCHAR para todas las columnas por consistencia
-        columns.append(f"{column} {sql_type}")
-    columns_str = ', '.join(columns)
-    query = f"CREATE TABLE egresos ({columns_str})"
-    cursor.execute(query)
-    print(f"Tabla egresos creada con columnas: {columns_str}")
-    conn.commit()
-
-# Función para calcular hash del DataFrame
-def calculate_dataframe_hash(df):
-    return hashlib.md5(pd.util.hash_pandas_object(df).values.tobytes()).hexdigest()
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 # Función para obtener el nombre del mes
 def get_month_name(month_num):
@@ -59,259 +101,394 @@ def get_month_name(month_num):
     }
     return months.get(int(month_num), 'Desconocido')
 
+# Resultado del trabajo de transformación de la sesión (None si no existe o no terminó),
+# con la carpeta propia del trabajo donde están sus archivos
+def get_transform_result():
+    job = get_job(session.get('transform_job'))
+    if job and job['status'] == 'completado':
+        return dict(job['result'], folder=os.path.join(current_app.config['TRANSFORMED_FOLDER'], job['id']))
+    return None
+
+# Variables de trabajos disponibles en todas las plantillas
+@bp.app_context_processor
+def job_context():
+    active_job = None
+    for key in ('transform_job', 'upload_job', 'batch_job'):
+        job = get_job(session.get(key))
+        if job and job['finished'] is None:
+            active_job = job['id']
+    return {'transform_ready': get_transform_result() is not None, 'active_job': active_job,
+            'uploaded_loads': uploaded_loads}
+
+# Historial de cargas desde el registro de la base de datos (la plantilla lo consulta solo
+# cuando lo muestra); si la base no responde se muestra vacío
+def uploaded_loads(limit=50):
+    backend = get_pool(current_app.config).backend
+    try:
+        return list_loads(backend, get_db(), limit)
+    except (backend.Error, PoolTimeout) as e:
+        logger.warning('no se pudo leer el registro de cargas', extra={'error': str(e)})
+        return []
+
+# Mostrar una sola vez el resultado de los trabajos terminados de la sesión
+def finished_job_messages():
+    context = {}
+    job = get_job(session.get('transform_job'))
+    if job and job['finished'] is not None and session.pop('transform_pending', False):
+        if job['status'] == 'error':
+            context['error'] = f"Error al procesar el archivo: {job['error']}"
+        elif job['result'].get('cached'):
+            context['message'] = 'Transformación completada (archivo ya transformado antes, obtenido del caché). Haz clic en Descargar o Subir a DB.'
+        else:
+            context['message'] = 'Transformación completada. Haz clic en Descargar o Subir a DB.'
+        if job['status'] != 'error' and job['result'].get('rejected_rows'):
+            context['message'] += f" Se descartaron {job['result']['rejected_rows']} filas con datos inválidos."
+            context['report_url'] = url_for('.rejection_report', job_id=job['id'])
+    job = get_job(session.get('upload_job'))
+    if job and job['finished'] is not None:
+        session.pop('upload_job')
+        if job['status'] == 'error':
+            context['error'] = f"Error al subir el archivo a la base de datos: {job['error']}"
+        else:
+            result = job['result']
+            context['message'] = result.get('message')
+            context['error'] = result.get('error')
+            context['replace_available'] = result.get('replace_available', False)
+    job = get_job(session.get('batch_job'))
+    if job and job['finished'] is not None:
+        session.pop('batch_job')
+        if job['status'] == 'error':
+            context['error'] = f"Error en la carga por lotes: {job['error']}"
+        else:
+            context['message'] = job['result'].get('message')
+            context['error'] = job['result'].get('error')
+            context['batch_report'] = job['result'].get('files')
+            if job['result'].get('report'):
+                context['report_url'] = url_for('.rejection_report', job_id=job['id'])
+    return context
+
 # Ruta principal para subir y transformar archivos
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 def upload_file():
-    print("Entrando en upload_file, método:", request.method)
     if request.method == 'POST':
-        print("Procesando solicitud POST")
         if 'file' not in request.files:
-            print("No se encontró el campo 'file' en la solicitud")
             return render_template('index.html', error='No se seleccionó ningún archivo')
         file = request.files['file']
-        print(f"Archivo recibido: {file.filename if file else 'Ningún archivo'}")
         if file.filename == '':
-            print("No se seleccionó ningún archivo")
             return render_template('index.html', error='No se seleccionó ningún archivo')
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            print(f"Guardando archivo en: {file_path}")
+            # Prefijo único para que dos usuarios con el mismo nombre de archivo no se pisen
+            filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+            logger.info('archivo subido', extra={'path': file_path})
             file.save(file_path)
             session.clear()
             session['uploaded_file'] = file_path
-            print("Session después de subir:", session)
-            return render_template('index.html', error=None, message='Archivo subido correctamente. Haz clic en Transformar.', uploaded_files=session.get('uploaded_files', {}))
+            return render_template('index.html', error=None, message='Archivo subido correctamente. Haz clic en Transformar.')
         else:
-            print(f"Extensión no permitida: {file.filename}")
+            logger.warning('extensión no permitida', extra={'archivo': file.filename})
             return render_template('index.html', error='Formato de archivo no permitido. Usa .xls, .xlsx o .csv.')
-    return render_template('index.html', error=None, message=None, uploaded_files=session.get('uploaded_files', {}))
-
-# Ruta para transformar el archivo
-@app.route('/transform', methods=['POST'])
+    context = {'error': None, 'message': None}
+    context.update(finished_job_messages())
+    return render_template('index.html', **context)
+
+# Opciones del caché de transformaciones para los trabajos (None si está desactivado)
+def get_cache_options():
+    if not current_app.config['TRANSFORM_CACHE']:
+        return None
+    return {'folder': current_app.config['TRANSFORM_CACHE_FOLDER'],
+            'max_bytes': current_app.config['TRANSFORM_CACHE_MAX_BYTES'],
+            'max_age': current_app.config['TRANSFORM_CACHE_MAX_AGE']}
+
+# Ruta para transformar el archivo: se encola en el pool de procesos y se consulta en /jobs/<id>
+@bp.route('/transform', methods=['POST'])
 def transform():
-    print("Entrando en transform")
+    from transform import run_transform
     if 'uploaded_file' not in session:
-        print("No hay archivo subido en la sesión")
-        return render_template('index.html', error='No hay archivo subido. Por favor, sube un archivo nuevo para transformarlo.', uploaded_files=session.get('uploaded_files', {}))
+        return render_template('index.html', error='No hay archivo subido. Por favor, sube un archivo nuevo para transformarlo.')
     
     file_path = session['uploaded_file']
-    print(f"Transformando archivo: {file_path}")
     if not os.path.exists(file_path):
-        print(f"Error: El archivo {file_path} no existe")
+        logger.warning('archivo subido no encontrado', extra={'path': file_path})
         session.clear()
-        return render_template('index.html', error='El archivo no se encuentra. Sube un nuevo archivo.', uploaded_files=session.get('uploaded_files', {}))
+        return render_template('index.html', error='El archivo no se encuentra. Sube un nuevo archivo.')
     
+    output_format = request.form.get('output_format', 'csv')
+    cache_options = get_cache_options()
+    # Cada trabajo escribe en su propia carpeta; las de trabajos vencidos se eliminan
+    cleanup_job_folders(current_app.config['TRANSFORMED_FOLDER'], current_app.config['JOB_OUTPUT_TTL'])
+    job_id = create_job('transform')
+    submit_process(job_id, run_transform, file_path, job_folder(current_app.config['TRANSFORMED_FOLDER'], job_id), output_format,
+                            current_app.config['TRANSFORM_STREAMING'], current_app.config['TRANSFORM_CHUNK_SIZE'], current_app.config['TRANSFORM_SORT'],
+                            cache_options, not current_app.config['DOWNLOAD_ON_THE_FLY'])
+    session['transform_job'] = job_id
+    session['transform_pending'] = True
+    logger.info('transformación encolada', extra={'job_id': job_id, 'output_format': output_format})
+
+    return render_template('index.html', message='Transformación en proceso...')
+
+# Carga por lotes: varios libros, un .zip o un libro con una hoja por mes. Las hojas se
+# transforman en paralelo y se cargan juntas; el informe por archivo queda en /jobs/<id>
+@bp.route('/batch', methods=['POST'])
+def batch_upload():
+    from batch import BATCH_EXTENSIONS, run_batch
+    files = [file for file in request.files.getlist('files') if file and file.filename]
+    if not files:
+        return render_template('index.html', error='No se seleccionó ningún archivo')
+    invalid = [file.filename for file in files if not file.filename.lower().endswith(BATCH_EXTENSIONS + ('.zip',))]
+    if invalid:
+        return render_template('index.html', error=f"Formato de archivo no permitido: {', '.join(invalid)}. Usa .xls, .xlsx o .zip.")
+
+    cleanup_job_folders(current_app.config['TRANSFORMED_FOLDER'], current_app.config['JOB_OUTPUT_TTL'])
+    job_id = create_job('batch')
+    folder = job_folder(current_app.config['UPLOAD_FOLDER'], job_id)
+    sources = []
+    for i, file in enumerate(files):
+        name = secure_filename(file.filename)
+        path = os.path.join(folder, f'{i:02d}_{name}')
+        file.save(path)
+        sources.append((path, name))
+    replace = request.form.get('replace') == 'yes'
+    submit_thread(job_id, run_batch, dict(current_app.config), job_id, folder, sources,
+                  job_folder(current_app.config['TRANSFORMED_FOLDER'], job_id), get_cache_options(), replace)
+    session['batch_job'] = job_id
+    logger.info('lote encolado', extra={'job_id': job_id, 'files': len(sources)})
+    return render_template('index.html', message='Carga por lotes en proceso...')
+
+# Ruta para consultar el estado de un trabajo en segundo plano
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job)
+
+# Descargar el informe de filas rechazadas por la validación de un trabajo
+@bp.route('/jobs/<job_id>/rechazos', methods=['GET'])
+def rejection_report(job_id):
+    from export import iter_file
+    job = get_job(job_id)
+    if job is None or not job['result'] or not job['result'].get('report'):
+        return jsonify({'error': 'El trabajo no tiene informe de rechazos'}), 404
+    path = os.path.join(current_app.config['TRANSFORMED_FOLDER'], job_id, job['result']['report'])
+    if not os.path.exists(path):
+        return jsonify({'error': 'El informe de rechazos ya no está disponible'}), 404
+    return Response(iter_file(path), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=rechazos_{job_id}.csv'})
+
+# Métricas del pool de conexiones: conexiones abiertas/en uso y tiempos de espera
+@bp.route('/metrics/pool', methods=['GET'])
+def pool_metrics():
+    return jsonify(get_pool(current_app.config).stats())
+
+# Métricas en formato de texto de Prometheus: solicitudes, trabajos, fases, filas y pool
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    for stat, value in get_pool(current_app.config).stats().items():
+        if isinstance(value, (int, float)):
+            POOL.set(value, stat=stat)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# API de consulta (solo lectura) sobre egresos: filtros anio, mes, ups, diag, sexo, idetareo
+# (uno o varios valores separados por coma) y paginación por clave con limit y after
+@bp.route('/api/egresos', methods=['GET'])
+def api_egresos():
     try:
-        df_final = transform_excel(file_path)
-
-        output_format = request.form.get('output_format', 'csv')
-        print(f"Formato seleccionado: {output_format}")
-        if output_format == 'xlsx':
-            transformed_filename = 'egresos_transformado.xlsx'
-            df_final.to_excel(os.path.join(app.config['TRANSFORMED_FOLDER'], transformed_filename), index=False, engine='openpyxl')
-            mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        else:
-            transformed_filename = 'egresos_transformado.csv'
-            df_final.to_csv(os.path.join(app.config['TRANSFORMED_FOLDER'], transformed_filename), index=False, encoding='utf-8')
-            mime_type = 'text/csv'
+        return jsonify(list_egresos(get_pool(current_app.config).backend, get_db(), request.args))
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
 
-        os.remove(file_path)
-        print(f"Archivo transformado guardado en: {os.path.join(app.config['TRANSFORMED_FOLDER'], transformed_filename)}")
-        print("Transformación completada, archivo temporal eliminado")
-
-        session['transformed_filename'] = transformed_filename
-        session['transformed_mime_type'] = mime_type
-        print("Session después de transformar:", session)
-
-        return render_template('index.html', message='Transformación completada. Haz clic en Descargar o Subir a DB.', uploaded_files=session.get('uploaded_files', {}))
-    except Exception as e:
-        print(f"Error en la transformación: {str(e)}")
-        os.remove(file_path) if os.path.exists(file_path) else None
-        return render_template('index.html', error=f'Error al procesar el archivo: {str(e)}', uploaded_files=session.get('uploaded_files', {}))
+# Conteos agrupados (group_by=mes,ups,...) con los mismos filtros que /api/egresos
+@bp.route('/api/egresos/resumen', methods=['GET'])
+def api_egresos_resumen():
+    try:
+        return jsonify(aggregate_egresos(get_pool(current_app.config).backend, get_db(), request.args))
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
 
 # Ruta para descargar el archivo
-@app.route('/download', methods=['GET'])
+@bp.route('/download', methods=['GET'])
 def download():
-    print("Entrando en download")
-    print(f"Session in download: {session}")
-    if 'transformed_filename' not in session or 'transformed_mime_type' not in session:
-        print("No hay archivo transformado para descargar - Contenido de session:", session)
-        return render_template('index.html', error='No hay archivo transformado para descargar', uploaded_files=session.get('uploaded_files', {}))
+    from transform import load_output, output_exists
+    from export import iter_csv, iter_file, gzip_stream
+    result = get_transform_result()
+    if result is None:
+        return render_template('index.html', error='No hay archivo transformado para descargar')
     
-    transformed_filename = session['transformed_filename']
-    mime_type = session['transformed_mime_type']
-    file_path = os.path.join(app.config['TRANSFORMED_FOLDER'], transformed_filename)
-    print(f"Descargando archivo: {file_path}")
+    transformed_filename = result['filename']
+    mime_type = result['mime_type']
+    file_path = os.path.join(result['folder'], transformed_filename)
     
-    if not os.path.exists(file_path):
-        print(f"Archivo no encontrado en: {file_path}")
-        return render_template('index.html', error='Archivo transformado no encontrado', uploaded_files=session.get('uploaded_files', {}))
-
-    response = send_file(
-        file_path,
-        mimetype=mime_type,
-        as_attachment=True,
-        download_name=transformed_filename
-    )
-    print("Descarga completada. Por favor, elimina manualmente el archivo en 'transformed/' si no se elimina automáticamente.")
+    # El XLSX siempre lo escribe la transformación; solo el CSV se puede generar al vuelo
+    if not os.path.exists(file_path) and (transformed_filename.endswith('.xlsx') or not output_exists(result['folder'], transformed_filename)):
+        logger.warning('archivo transformado no encontrado', extra={'path': file_path})
+        return render_template('index.html', error='Archivo transformado no encontrado')
+
+    # Enviar por bloques: el archivo ya escrito o, si no existe, el CSV generado al vuelo desde el DataFrame
+    if os.path.exists(file_path):
+        chunks = iter_file(file_path)
+    else:
+        df = load_output(result['folder'], transformed_filename)
+        chunks = iter_csv(df, current_app.config['DOWNLOAD_CHUNK_ROWS'])
+    headers = {'Content-Disposition': f'attachment; filename={transformed_filename}'}
+    # CSV comprimido con gzip si el navegador lo acepta
+    if transformed_filename.endswith('.csv') and request.accept_encodings['gzip']:
+        chunks = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    chunks = timed_stream(chunks, 'download', 'serialize')
+    response = Response(chunks, mimetype=mime_type, headers=headers)
+    logger.info('descarga iniciada', extra={'archivo': transformed_filename, 'gzip': 'Content-Encoding' in headers})
     session.clear()
-    print("Sesión limpiada después de la descarga:", session)
 
     return response
 
-# Nueva ruta para subir el archivo transformado a SQL Server
-@app.route('/upload_to_db', methods=['POST'])
-def upload_to_db():
-    print("Entrando en upload_to_db")
-    if 'transformed_filename' not in session or 'transformed_mime_type' not in session:
-        print("No hay archivo transformado para subir a la base de datos - Contenido de session:", session)
-        return render_template('index.html', error='No hay archivo transformado para subir a la base de datos', uploaded_files=session.get('uploaded_files', {}))
-    
-    transformed_filename = session['transformed_filename']
-    file_path = os.path.join(app.config['TRANSFORMED_FOLDER'], transformed_filename)
-    print(f"Subiendo archivo transformado: {file_path}")
-    
-    if not os.path.exists(file_path):
-        print(f"Archivo no encontrado en: {file_path}")
-        return render_template('index.html', error='Archivo transformado no encontrado', uploaded_files=session.get('uploaded_files', {}))
-    
+# Tarea de subida a la base de datos (se ejecuta en el pool de hilos, sin acceso a la sesión).
+# La carga queda en el registro con el id del trabajo (carga_id).
+# Devuelve un diccionario con el mensaje o error a mostrar.
+def run_upload(progress, config, carga_id, transformed_filename, output_folder, replace=False):
+    from transform import load_output
+    pool = get_pool(config)
+    backend = pool.backend
     try:
-        # Leer el archivo transformado
-        if transformed_filename.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif transformed_filename.endswith('.xlsx'):
-            df = pd.read_excel(file_path)
-        else:
-            return render_template('index.html', error='Formato de archivo transformado no soportado', uploaded_files=session.get('uploaded_files', {}))
-
-        # Depuración
-        print(f"Columnas de df: {df.columns.tolist()}")
-        print(f"Tipos de datos de df: {df.dtypes}")
-        print(f"Valores de totalest: {df['totalest'].head().to_string()}")
-        print(f"Valores únicos de totalest: {df['totalest'].unique()}")
-        print(f"Valores de la fila 0 como lista: {list(df.iloc[0])}")
-
-        # Convertir todas las columnas a string para evitar problemas con nan
-        for column in df.columns:
-            df[column] = df[column].astype(str).replace('nan', '').fillna('')
-
-        # Obtener mes y año representativos (primer registro como referencia)
-        month = int(df['mes'].iloc[0]) if df['mes'].iloc[0].isdigit() else 1
-        year = int(df['anio'].iloc[0]) if df['anio'].iloc[0].isdigit() else datetime.now().year
-        session['last_month'] = str(month)
-        session['last_year'] = str(year)
-
-        # Verificar si los registros ya existen en la base de datos
-        conn_str = app.config['DATABASE']
-        conn = pyodbc.connect(conn_str)
-        cursor = conn.cursor()
-        existing_records = 0
-        for index, row in df.iterrows():
-            query = "SELECT COUNT(*) FROM egresos WHERE anio = ? AND mes = ? AND numhc = ?"
-            cursor.execute(query, (row['anio'], row['mes'], row['numhc']))
-            if cursor.fetchone()[0] > 0:
-                existing_records += 1
-        conn.close()
-
-        if existing_records == len(df):
-            return render_template('index.html', error=f'El archivo {transformed_filename} contiene registros del mes de {get_month_name(month)} del año {year} que ya existen en la base de datos. No se realizará una nueva inserción.', uploaded_files=session.get('uploaded_files', {}))
-        elif existing_records > 0:
-            return render_template('index.html', error=f'El archivo {transformed_filename} contiene {existing_records} registros del mes de {get_month_name(month)} del año {year} que ya existen en la base de datos. Se insertarán los registros nuevos.', uploaded_files=session.get('uploaded_files', {}))
-
-        # Conectar a SQL Server y recrear tabla si es necesario
-        conn = pyodbc.connect(conn_str)
-        create_or_recreate_table(df, conn)
-        cursor = conn.cursor()
-        cursor.fast_executemany = True
-        row_count = 0
-        for index, row in df.iterrows():
-            print(f"Insertando fila {index}: {list(row)}")  # Depuración de cada fila
-            columns = ', '.join(df.columns)
-            placeholders = ', '.join(['?' for _ in df.columns])
-            query = f"INSERT INTO egresos ({columns}) VALUES ({placeholders})"
-            cursor.execute(query, list(row))
-            row_count += 1
-        conn.commit()
-        conn.close()
-
-        # Actualizar lista de archivos subidos
-        uploaded_files = session.get('uploaded_files', {})
-        current_hash = calculate_dataframe_hash(df)
-        uploaded_files[transformed_filename] = current_hash
-        session['uploaded_files'] = uploaded_files
+        # Leer la salida del trabajo (el DataFrame binario si existe, sin reparsear el CSV/XLSX)
+        progress(phase='leyendo')
+        if not transformed_filename.endswith(('.csv', '.xlsx')):
+            return {'error': 'Formato de archivo transformado no soportado'}
+        timings = {}
+        with phase_timer(timings, 'read'):
+            df = load_output(output_folder, transformed_filename)
+
+        # Muestra de filas solo con LOG_ROW_DUMPS (contiene datos de pacientes)
+        if config.get('LOG_ROW_DUMPS'):
+            logger.debug('muestra de filas', extra={'carga_id': carga_id, 'columns': df.columns.tolist(),
+                                                     'dtypes': df.dtypes.astype(str).to_dict(), 'head': df.head().to_dict('records')})
+
+        # Convertir las columnas al tipo del esquema (enteros anulables, vacíos como NULL)
+        with phase_timer(timings, 'normalize'):
+            df = normalize_types(df)
+
+        # Mes y año del archivo: la validación deja un solo periodo (anio, mes) por archivo
+        periodos = sorted(partitions(df))
+        if not periodos:
+            return {'error': f'El archivo {transformed_filename} no tiene registros válidos para subir.'}
+        year, month = periodos[0]
+
+        # Una sola conexión del pool para la verificación de duplicados y la inserción
+        with pool.connection() as conn:
+            # Crear las tablas si no existen y verificar si los registros ya existen en la base de datos
+            progress(phase='verificando duplicados', rows=len(df))
+            ensure_schema(backend, conn)
+            ensure_registry(backend, conn)
+            ensure_summaries(backend, conn)
+
+            # El mismo contenido ya cargado se detecta en el registro por su hash
+            with phase_timer(timings, 'dedup'):
+                content_hash = calculate_dataframe_hash(df)
+                previous = find_by_hash(backend, conn, content_hash)
+                if previous and not replace:
+                    return {'error': f"El archivo {transformed_filename} ya fue cargado el {previous['inicio']} (carga {previous['carga_id']}). No se realizará una nueva inserción.", 'replace_available': True}
+                existing_records, new_records = count_existing(backend, conn, df)
+                en_base = count_partition_rows(backend, conn, periodos)
+            logger.info('verificación de duplicados', extra={'carga_id': carga_id, 'existing': existing_records, 'new': new_records,
+                                                             'partition_rows': sum(en_base.values())})
+
+            # Si todos los registros ya están cargados se pide confirmación para reemplazar el mes
+            if existing_records == len(df) and not replace:
+                return {'error': f'El archivo {transformed_filename} contiene registros del mes de {get_month_name(month)} del año {year} que ya existen en la base de datos. No se realizará una nueva inserción.', 'replace_available': True}
+            # Subir el archivo reemplaza el mes completo: si el mes ya tiene registros (aunque
+            # no coincidan con los del archivo) se pide confirmación
+            if en_base and not replace:
+                return {'error': f'El mes de {get_month_name(month)} del año {year} ya tiene {sum(en_base.values())} registros en la base de datos '
+                                 f'({existing_records} filas del archivo coinciden con ellos y {new_records} son nuevas). Subir {transformed_filename} '
+                                 f'reemplazará todos los registros de ese mes. No se realizó ninguna inserción.', 'replace_available': True}
+
+            # Reemplazar solo los meses del archivo en una sola transacción; los demás meses se conservan.
+            # La carga se registra y las tablas de resumen se actualizan en la misma transacción
+            progress(phase='insertando', rows=0)
+            inicio = datetime.now()
+
+            def registrar(cursor, rows, replaced):
+                update_summaries(backend, conn, df)
+                register_load(cursor, carga_id, transformed_filename, content_hash, partitions(df), rows,
+                              sum(replaced.values()), inicio, datetime.now())
+
+            row_count, replaced_count, seconds = replace_partitions(backend, conn, df, batch_size=config['BULK_BATCH_SIZE'], strategy=config['BULK_STRATEGY'],
+                                                                    progress=progress, before_commit=registrar)
+            timings['insert'] = round(seconds, 6)
+        for anio, mes in partitions(df):
+            result_cache.invalidate(anio, mes)
+        rows_per_second = row_count / seconds if seconds > 0 else row_count
+        logger.info('carga masiva', extra={'carga_id': carga_id, 'rows': row_count, 'seconds': round(seconds, 3),
+                                           'rows_per_second': round(rows_per_second)})
 
         # Mensaje de éxito con mes y año
-        message = f'Archivo {transformed_filename} subido satisfactoriamente a SQL Server. Se insertaron {row_count} registros del mes de {get_month_name(month)} del año {year}.'
-        print(message)
-        return render_template('index.html', message=message, uploaded_files=session.get('uploaded_files', {}))
-
-    except pyodbc.Error as e:
-        print(f"Error de conexión a SQL Server: {str(e)}")
-        return render_template('index.html', error=f'Error al conectar a SQL Server: {str(e)}. Verifica la configuración en config.py.', uploaded_files=session.get('uploaded_files', {}))
-    except Exception as e:
-        print(f"Error al subir a la base de datos: {str(e)}")
-        return render_template('index.html', error=f'Error al subir el archivo a la base de datos: {str(e)}', uploaded_files=session.get('uploaded_files', {}))
-
-# Ruta para eliminar un registro subido
-@app.route('/delete_uploaded', methods=['POST'])
-def delete_uploaded():
-    if 'uploaded_files' not in session or not session['uploaded_files']:
-        return render_template('index.html', error='No hay registros subidos para eliminar.', uploaded_files=session.get('uploaded_files', {}))
+        message = f'Archivo {transformed_filename} subido satisfactoriamente a {backend.name}. Se insertaron {row_count} registros del mes de {get_month_name(month)} del año {year} en {seconds:.2f} s ({rows_per_second:.0f} filas/s).'
+        if replaced_count:
+            message += f' Se reemplazaron {replaced_count} registros anteriores del mismo mes ({existing_records} coincidían con el archivo y {new_records} son nuevos).'
+        return {'uploaded': True, 'message': message, 'filename': transformed_filename, 'carga_id': carga_id,
+                'hash': content_hash, 'month': month, 'year': year, 'rows': row_count, 'replaced': replaced_count,
+                'timings': timings}
+
+    except backend.Error as e:
+        logger.error('error de base de datos en la subida', extra={'carga_id': carga_id, 'backend': backend.name}, exc_info=True)
+        return {'error': f'Error al conectar a {backend.name}: {str(e)}. Verifica la configuración en config.py.'}
+
+# Nueva ruta para subir el archivo transformado a la base de datos (en segundo plano)
+@bp.route('/upload_to_db', methods=['POST'])
+def upload_to_db():
+    from transform import output_exists
+    result = get_transform_result()
+    if result is None:
+        return render_template('index.html', error='No hay archivo transformado para subir a la base de datos')
     
-    filename = request.form.get('filename')
-    confirm_delete = request.form.get('confirm_delete') == 'yes'
+    transformed_filename = result['filename']
+    file_path = os.path.join(result['folder'], transformed_filename)
     
-    if filename and filename in session['uploaded_files']:
-        file_path = os.path.join(app.config['TRANSFORMED_FOLDER'], filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
-        if not confirm_delete:
-            return render_template('index.html', message=f'La eliminación de {filename} requiere confirmación. Por favor, confirma en el modal.', uploaded_files=session.get('uploaded_files', {}))
-
-        # Conectar a SQL Server y eliminar registros asociados
-        conn_str = app.config['DATABASE']
-        try:
-            conn = pyodbc.connect(conn_str)
-            cursor = conn.cursor()
-            
-            # Usar los valores de mes y año almacenados en la sesión
-            month = session.get('last_month', '01')
-            year = session.get('last_year', str(datetime.now().year))
-            print(f"Intentando eliminar registros con anio={year} y mes={month}")
-
-            # Eliminar registros basados en anio y mes
-            query = "DELETE FROM egresos WHERE anio = ? AND mes = ?"
-            rows_affected = cursor.execute(query, (year, month)).rowcount
-            print(f"Filas eliminadas: {rows_affected}")
-            conn.commit()
-            conn.close()
-            
-            if rows_affected == 0:
-                print("No se encontraron registros para eliminar con los criterios dados.")
-        except pyodbc.Error as e:
-            print(f"Error al eliminar registros de la base de datos: {str(e)}")
-            conn.close()  # Asegurar cierre incluso con error
-            return render_template('index.html', error=f'Error al eliminar registros de la base de datos: {str(e)}', uploaded_files=session.get('uploaded_files', {}))
-
-        # Eliminar de la sesión
-        del session['uploaded_files'][filename]
-        if not session['uploaded_files']:
-            session.pop('uploaded_files')
-        
-        return render_template('index.html', message=f'Registro {filename} y sus datos en la base de datos eliminados exitosamente. Filas afectadas: {rows_affected}.', uploaded_files=session.get('uploaded_files', {}))
-    return render_template('index.html', error='Archivo no encontrado o no se pudo eliminar.', uploaded_files=session.get('uploaded_files', {}))
+    if not output_exists(result['folder'], transformed_filename):
+        logger.warning('archivo transformado no encontrado', extra={'path': file_path})
+        return render_template('index.html', error='Archivo transformado no encontrado')
+
+    replace = request.form.get('replace') == 'yes'
+    job_id = create_job('upload')
+    submit_thread(job_id, run_upload, dict(current_app.config), job_id, transformed_filename, result['folder'], replace)
+    session['upload_job'] = job_id
+    logger.info('subida encolada', extra={'job_id': job_id, 'replace': replace})
+    return render_template('index.html', message='Subida a la base de datos en proceso...')
+
+# Ruta para eliminar una carga del registro y sus datos en la base de datos
+@bp.route('/delete_uploaded', methods=['POST'])
+def delete_uploaded():
+    carga_id = request.form.get('carga_id')
+    filename = request.form.get('filename') or carga_id
+    confirm_delete = request.form.get('confirm_delete') == 'yes'
+    if not carga_id:
+        return render_template('index.html', error='No hay registros subidos para eliminar.')
+    if not confirm_delete:
+        return render_template('index.html', message=f'La eliminación de {filename} requiere confirmación. Por favor, confirma en el modal.')
+
+    # Eliminar los meses que la carga todavía tiene en la base de datos (según el registro)
+    backend = get_pool(current_app.config).backend
+    try:
+        deleted = delete_load(backend, get_db(), carga_id)
+    except backend.Error as e:
+        logger.error('error al eliminar una carga', extra={'carga_id': carga_id}, exc_info=True)
+        return render_template('index.html', error=f'Error al eliminar registros de la base de datos: {str(e)}')
+    if deleted is None:
+        return render_template('index.html', error='Archivo no encontrado o no se pudo eliminar.')
+
+    carga, rows_affected, deleted_partitions = deleted
+    for anio, mes in deleted_partitions:
+        result_cache.invalidate(anio, mes)
+    logger.info('carga eliminada', extra={'carga_id': carga_id, 'rows': rows_affected, 'partitions': deleted_partitions})
+    return render_template('index.html', message=f"Registro {carga['archivo']} y sus datos en la base de datos eliminados exitosamente. Filas afectadas: {rows_affected}.")
 
 # Nueva ruta para el historial
-@app.route('/history', methods=['GET'])
+@bp.route('/history', methods=['GET'])
 def history():
-    print("Entrando en history")
-    uploaded_files = session.get('uploaded_files', {})
-    print(f"Historial de archivos: {uploaded_files}")
-    if not uploaded_files:
-        return render_template('index.html', error='No hay historial de registros subidos.', uploaded_files=uploaded_files)
-    return render_template('index.html', message='Historial de registros subidos:', uploaded_files=uploaded_files)
+    if not uploaded_loads(1):
+        return render_template('index.html', error='No hay historial de registros subidos.')
+    return render_template('index.html', message='Historial de registros subidos:')
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,222 @@
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import as_completed
+from datetime import datetime
+
+import pandas as pd
+from werkzeug.utils import secure_filename
+
+import cache
+from db import get_pool, count_partition_rows, ensure_schema, normalize_types, partitions, replace_partitions
+from jobs import submit_task
+from queries import result_cache
+from registry import calculate_dataframe_hash, ensure_registry, register_load
+from summaries import ensure_summaries, update_summaries
+from transform import REJECTION_REPORT, TRANSFORM_VERSION, transform_dataframe
+from validation import ValidationError, validate_dataframe
+
+# Libros que se aceptan dentro de un lote (sueltos o dentro de un .zip)
+BATCH_EXTENSIONS = ('.xlsx', '.xls')
+
+
+# Extraer los libros Excel de un .zip a la carpeta del lote (sin subcarpetas, nombres seguros).
+# Devuelve [(ruta, nombre)]
+def extract_zip(zip_path, folder):
+    libros = []
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            name = secure_filename(os.path.basename(info.filename))
+            if info.is_dir() or not name.lower().endswith(BATCH_EXTENSIONS):
+                continue
+            path = os.path.join(folder, f'zip{len(libros):02d}_{name}')
+            with zf.open(info) as origen, open(path, 'wb') as destino:
+                shutil.copyfileobj(origen, destino)
+            libros.append((path, name))
+    return libros
+
+
+def list_sheets(file_path):
+    with pd.ExcelFile(file_path) as libro:
+        return libro.sheet_names
+
+
+# Leer, validar y transformar una hoja (se ejecuta en el pool de procesos). Las hojas sin
+# la columna fecegr (notas, resúmenes) se omiten. Devuelve el DataFrame, los rechazos y los tiempos.
+def transform_sheet(file_path, sheet_name, cache_options=None):
+    inicio = time.perf_counter()
+    result = {'rows_in': None, 'rows': 0, 'cached': False, 'skipped': False, 'read_seconds': 0.0, 'validate_seconds': 0.0,
+              'transform_seconds': 0.0, 'frame': None, 'rechazos': None}
+    key = None
+    if cache_options:
+        key = cache.file_key(file_path, f'{TRANSFORM_VERSION}:{sheet_name}')
+        df_final = cache.load(cache_options['folder'], key)
+        rechazos = cache.load(cache_options['folder'], f'{key}_rechazos')
+        if df_final is not None and rechazos is not None:
+            result.update(rows=len(df_final), cached=True, frame=df_final, rechazos=rechazos, read_seconds=round(time.perf_counter() - inicio, 3))
+            return result
+
+    df = pd.read_excel(file_path, sheet_name=sheet_name)
+    leido = time.perf_counter()
+    result.update(rows_in=len(df), read_seconds=round(leido - inicio, 3))
+    if 'fecegr' not in df.columns:
+        result['skipped'] = True
+        return result
+    df, rechazos = validate_dataframe(df)
+    validado = time.perf_counter()
+    df_final = transform_dataframe(df)
+    result.update(rows=len(df_final), frame=df_final, rechazos=rechazos, validate_seconds=round(validado - leido, 3),
+                  transform_seconds=round(time.perf_counter() - validado, 3))
+    if key is not None:
+        cache.store(cache_options['folder'], key, df_final)
+        cache.store(cache_options['folder'], f'{key}_rechazos', rechazos)
+        cache.evict(cache_options['folder'], cache_options['max_bytes'], cache_options['max_age'])
+    return result
+
+
+def _periodo(anio, mes):
+    return f'{anio}-{mes:02d}'
+
+
+# Trabajo de carga por lotes (pool de hilos): transforma cada hoja de cada libro en paralelo
+# en el pool de procesos, verifica que ningún mes (anio, mes) venga en dos hojas y carga todo
+# en una sola transacción, reemplazando esos meses. Cada hoja queda como una carga en el
+# registro. sources: [(ruta, nombre)] guardados en folder, que se elimina al terminar.
+# Las filas rechazadas por la validación se juntan en REJECTION_REPORT dentro de report_folder.
+# Si algún mes ya tiene registros en la base de datos no se carga nada salvo con replace=True.
+def run_batch(progress, config, batch_id, folder, sources, report_folder, cache_options=None, replace=False):
+    inicio_lote = time.perf_counter()
+    try:
+        progress(phase='preparando')
+        libros = []
+        for path, name in sources:
+            if name.lower().endswith('.zip'):
+                libros.extend(extract_zip(path, folder))
+            else:
+                libros.append((path, name))
+        if not libros:
+            return {'error': 'El lote no contiene libros Excel (.xlsx o .xls).', 'files': []}
+
+        unidades = []
+        for path, name in libros:
+            hojas = list_sheets(path)
+            for sheet in hojas:
+                unidades.append({'archivo': name, 'hoja': sheet if len(hojas) > 1 else None, 'path': path, 'sheet': sheet})
+
+        # Transformar todas las hojas en paralelo
+        futures = {submit_task(transform_sheet, unidad['path'], unidad['sheet'], cache_options): unidad for unidad in unidades}
+        rows = 0
+        for n, future in enumerate(as_completed(futures), 1):
+            unidad = futures[future]
+            try:
+                unidad.update(future.result())
+            except ValidationError as e:
+                for pendiente in futures:
+                    pendiente.cancel()
+                return {'error': f"{unidad['archivo']}{' [' + unidad['hoja'] + ']' if unidad['hoja'] else ''}: {str(e)}", 'files': []}
+            except Exception as e:
+                for pendiente in futures:
+                    pendiente.cancel()
+                return {'error': f"Error al transformar {unidad['archivo']}{' [' + unidad['hoja'] + ']' if unidad['hoja'] else ''}: {str(e)}",
+                        'files': []}
+            rows += unidad['rows']
+            progress(phase=f'transformando ({n}/{len(futures)} hojas)', rows=rows)
+
+        # Verificar que los meses no se repitan entre hojas
+        progress(phase='verificando meses')
+        cargadas = [unidad for unidad in unidades if not unidad['skipped']]
+        duenos = {}
+        conflictos = []
+        for i, unidad in enumerate(cargadas):
+            unidad['frame'] = normalize_types(unidad['frame'])
+            unidad['partitions'] = partitions(unidad['frame'])
+            unidad['carga_id'] = f'{batch_id}_{i}' if len(unidad['frame']) else None
+            for particion in unidad['partitions']:
+                if particion in duenos:
+                    conflictos.append(f"{_periodo(*particion)} ({duenos[particion]} y {unidad['archivo']})")
+                duenos.setdefault(particion, unidad['archivo'])
+
+        report = [{
+            'archivo': unidad['archivo'],
+            'hoja': unidad['hoja'],
+            'rows_in': unidad['rows_in'],
+            'rows': unidad['rows'],
+            'cached': unidad['cached'],
+            'skipped': unidad['skipped'],
+            'rejected_rows': int(unidad['rechazos']['fila'].nunique()) if unidad.get('rechazos') is not None else 0,
+            'read_seconds': unidad['read_seconds'],
+            'validate_seconds': unidad['validate_seconds'],
+            'transform_seconds': unidad['transform_seconds'],
+            'periodos': [_periodo(*particion) for particion in unidad.get('partitions', [])],
+            'carga_id': unidad.get('carga_id'),
+        } for unidad in unidades]
+
+        # Informe de rechazos de todo el lote, con el archivo y la hoja de cada fila
+        partes = [unidad['rechazos'].assign(archivo=unidad['archivo'], hoja=unidad['hoja'] or '')
+                  for unidad in cargadas if len(unidad['rechazos'])]
+        report_name = None
+        if partes:
+            rechazos = pd.concat(partes, ignore_index=True)
+            rechazos[['archivo', 'hoja'] + [column for column in rechazos.columns if column not in ('archivo', 'hoja')]].to_csv(
+                os.path.join(report_folder, REJECTION_REPORT), index=False, encoding='utf-8')
+            report_name = REJECTION_REPORT
+        rejected_rows = sum(item['rejected_rows'] for item in report)
+        if conflictos:
+            return {'error': f"Los mismos meses vienen en más de un archivo: {', '.join(conflictos)}. No se cargó nada.", 'files': report,
+                    'rejected_rows': rejected_rows, 'report': report_name}
+        if not cargadas:
+            return {'error': 'Ninguna hoja del lote tiene la columna fecegr.', 'files': report}
+        # Las hojas sin filas válidas no se registran como carga
+        cargadas = [unidad for unidad in cargadas if len(unidad['frame'])]
+        if not cargadas:
+            return {'error': 'Ninguna fila del lote pasó la validación. No se cargó nada.', 'files': report,
+                    'rejected_rows': rejected_rows, 'report': report_name}
+
+        # Una sola transacción para todo el lote, con una carga registrada por hoja y las
+        # tablas de resumen actualizadas
+        df = pd.concat([unidad['frame'] for unidad in cargadas], ignore_index=True)
+        pool = get_pool(config)
+        backend = pool.backend
+        with pool.connection() as conn:
+            progress(phase='insertando', rows=0)
+            ensure_schema(backend, conn)
+            ensure_registry(backend, conn)
+            ensure_summaries(backend, conn)
+            en_base = count_partition_rows(backend, conn, sorted(duenos))
+            if en_base and not replace:
+                ocupados = ', '.join(f'{_periodo(*particion)} ({filas} registros)' for particion, filas in sorted(en_base.items()))
+                return {'error': f'Estos meses ya tienen registros en la base de datos y el lote los reemplazaría completos: {ocupados}. '
+                                 'No se cargó nada; marca «Reemplazar los meses que ya tienen registros» y envía el lote de nuevo.',
+                        'files': report, 'rejected_rows': rejected_rows, 'report': report_name}
+            inicio = datetime.now()
+
+            def registrar(cursor, row_count, replaced):
+                update_summaries(backend, conn, df)
+                fin = datetime.now()
+                for unidad in cargadas:
+                    reemplazadas = sum(replaced.get(particion, 0) for particion in unidad['partitions'])
+                    register_load(cursor, unidad['carga_id'], unidad['archivo'] if not unidad['hoja'] else f"{unidad['archivo']} [{unidad['hoja']}]",
+                                  calculate_dataframe_hash(unidad['frame']), unidad['partitions'], len(unidad['frame']), reemplazadas, inicio, fin)
+
+            row_count, replaced_count, seconds = replace_partitions(backend, conn, df, batch_size=config['BULK_BATCH_SIZE'], strategy=config['BULK_STRATEGY'],
+                                                                    progress=progress, before_commit=registrar)
+
+        for anio, mes in duenos:
+            result_cache.invalidate(anio, mes)
+        total_seconds = time.perf_counter() - inicio_lote
+        message = (f'Lote cargado a {backend.name}: {len(cargadas)} hojas de {len(libros)} libros, {row_count} registros '
+                   f'en {total_seconds:.2f} s (carga a la base de datos {seconds:.2f} s).')
+        if replaced_count:
+            message += f' Se reemplazaron {replaced_count} registros anteriores de los mismos meses.'
+        if rejected_rows:
+            message += f' Se descartaron {rejected_rows} filas con datos inválidos.'
+        return {'uploaded': True, 'message': message, 'files': report, 'rows': row_count, 'replaced': replaced_count,
+                'rejected_rows': rejected_rows, 'report': report_name,
+                'timings': {'read': [unidad['read_seconds'] for unidad in unidades],
+                            'validate': [unidad['validate_seconds'] for unidad in cargadas],
+                            'transform': [unidad['transform_seconds'] for unidad in cargadas],
+                            'insert': round(seconds, 6)},
+                'partitions': sorted(duenos), 'load_seconds': round(seconds, 3), 'total_seconds': round(total_seconds, 3)}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,225 @@
+# Benchmark de la transformación y de la subida a la base de datos.
+#
+# Genera libros sintéticos de egresos (fecegr, edad, coddiag1-4, cemorb1-2, codcpt1-4, ...),
+# mide cada fase y guarda los tiempos en JSON para comparar entre versiones:
+#
+#     python benchmark.py --sizes 1000 100000 1000000 --output benchmarks
+#
+# La subida se mide contra una copia temporal de transmed.db (backend SQLite).
+# El arranque de la aplicación (importar app, create_app, primera solicitud y warmup) se
+# mide en procesos nuevos.
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from db import SQLiteBackend, count_existing, count_partition_rows, ensure_schema, normalize_types, partitions, replace_partitions
+from registry import calculate_dataframe_hash, ensure_registry, find_by_hash, register_load
+from summaries import ensure_summaries, update_summaries
+from transform import TRANSFORM_VERSION, transform_dataframe, transform_excel_chunks, write_transformed_csv, write_xlsx
+from validation import validate_dataframe
+
+NOMBRES = ['ANA', 'LUIS', 'ABEL RENE', 'MARIA', 'JUAN CARLOS', 'ROSA', 'ADRIANA NICOLE', 'PEDRO']
+APELLIDOS = ['QUISPE', 'MAMANI', 'CASILLA', 'TICONA', 'CONDORI', 'GUTIERREZ', 'LARICO', 'APAZA']
+UPS = [240700, 241200, 241600, 242000]
+UBIGEOS = [210101, 210104, 210105, 211101]
+
+
+# Códigos con forma CIE-10 (letra + 3 dígitos); una fracción vacía (NaN) y otra ''
+def _codigos(rng, n, vacios, letras='ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
+    letra = rng.choice(list(letras), n)
+    numero = rng.integers(0, 1000, n)
+    codigos = np.char.add(letra.astype(str), np.char.zfill(numero.astype(str), 3)).astype(object)
+    azar = rng.random(n)
+    codigos[azar < vacios] = np.nan
+    codigos[(azar >= vacios) & (azar < vacios + 0.02)] = ''
+    return codigos
+
+
+# DataFrame sintético con las columnas del Excel de egresos
+def generate_egresos(n, anio=2025, mes=1, seed=0):
+    rng = np.random.default_rng(seed)
+    dias = rng.integers(1, 29, n)
+    fecegr = np.char.add(f'{mes:02d}/', np.char.add(np.char.zfill(dias.astype(str), 2), f'/{anio % 100:02d}'))
+    edad = rng.integers(0, 95, n)
+    apell = np.char.add(np.char.add(rng.choice(APELLIDOS, n), ' '), rng.choice(APELLIDOS, n))
+    return pd.DataFrame({
+        'fecegr': fecegr.astype(object),
+        'numhc': rng.integers(10_000_000, 99_999_999, n).astype(str),
+        'doc_iden': rng.integers(0, 3, n),
+        'etnia': 80,
+        'sexo': rng.integers(1, 3, n),
+        'edad': edad,
+        'tipoedad': 1,
+        'ups': rng.choice(UPS, n),
+        'totalest': rng.integers(1, 30, n),
+        'nomb': rng.choice(NOMBRES, n),
+        'apell': apell,
+        'ubigeo': rng.choice(UBIGEOS, n),
+        'condicion': rng.integers(1, 4, n),
+        'coddiag1': _codigos(rng, n, 0.01),
+        'coddiag2': _codigos(rng, n, 0.5),
+        'coddiag3': _codigos(rng, n, 0.8),
+        'coddiag4': _codigos(rng, n, 0.9),
+        'cemorb1': _codigos(rng, n, 0.7, 'VWXY'),
+        'cemorb2': _codigos(rng, n, 0.9, 'VWXY'),
+        'codcpt1': _codigos(rng, n, 0.6, 'Z'),
+        'codcpt2': _codigos(rng, n, 0.8, 'Z'),
+        'codcpt3': _codigos(rng, n, 0.9, 'Z'),
+        'codcpt4': _codigos(rng, n, 0.95, 'Z'),
+    })
+
+
+# Escribir el libro en modo write-only (to_excel es demasiado lento para 1M de filas)
+def write_workbook(df, path):
+    write_xlsx(df, path)
+
+
+def _medir(resultados, fase, fn, *args, **kwargs):
+    inicio = time.perf_counter()
+    valor = fn(*args, **kwargs)
+    resultados[fase] = round(time.perf_counter() - inicio, 4)
+    print(f"  {fase}: {resultados[fase]:.3f} s")
+    return valor
+
+
+# Subida completa a SQLite por el mismo camino que run_upload: tipos, esquema, registro de
+# cargas y tablas de resumen, hash y duplicados, y reemplazo de la partición con el registro
+# de la carga y los resúmenes dentro de la misma transacción
+def _subir(db_path, df):
+    backend = SQLiteBackend(db_path)
+    conn = backend.connect()
+    try:
+        df = normalize_types(df)
+        ensure_schema(backend, conn)
+        ensure_registry(backend, conn)
+        ensure_summaries(backend, conn)
+        content_hash = calculate_dataframe_hash(df)
+        find_by_hash(backend, conn, content_hash)
+        count_existing(backend, conn, df)
+        count_partition_rows(backend, conn, partitions(df))
+        inicio = datetime.now()
+
+        def registrar(cursor, rows, replaced):
+            update_summaries(backend, conn, df)
+            register_load(cursor, 'benchmark', 'egresos_transformado.csv', content_hash, partitions(df), rows,
+                          sum(replaced.values()), inicio, datetime.now())
+
+        row_count, _, _ = replace_partitions(backend, conn, df, before_commit=registrar)
+    finally:
+        conn.close()
+    return row_count
+
+
+def run_size(n, work_dir, database, skip):
+    print(f"Egresos sintéticos: {n} filas")
+    workbook = os.path.join(work_dir, f'egresos_{n}.xlsx')
+    resultados = {'rows_in': n}
+    if not os.path.exists(workbook):
+        _medir(resultados, 'generate_workbook', write_workbook, generate_egresos(n), workbook)
+
+    df = _medir(resultados, 'read_excel', pd.read_excel, workbook)
+    df, rechazos = _medir(resultados, 'validate', validate_dataframe, df)
+    resultados['rows_rejected'] = int(rechazos['fila'].nunique())
+    df_final = _medir(resultados, 'transform', transform_dataframe, df)
+    resultados['rows_out'] = len(df_final)
+    resultados['transform_excel'] = round(resultados['read_excel'] + resultados['validate'] + resultados['transform'], 4)
+
+    _medir(resultados, 'write_csv', df_final.to_csv, os.path.join(work_dir, 'salida.csv'), index=False, encoding='utf-8')
+    if 'xlsx' not in skip:
+        _medir(resultados, 'write_xlsx', write_xlsx, df_final, os.path.join(work_dir, 'salida.xlsx'))
+    if 'streaming' not in skip:
+        _medir(resultados, 'streaming_transform_csv', write_transformed_csv,
+               transform_excel_chunks(workbook), os.path.join(work_dir, 'salida_lotes.csv'))
+    if 'upload' not in skip:
+        db_path = os.path.join(work_dir, 'benchmark.db')
+        shutil.copy(database, db_path)
+        _medir(resultados, 'upload_to_db', _subir, db_path, df_final.copy())
+        resultados['upload_rows_per_second'] = round(len(df_final) / resultados['upload_to_db'])
+        os.remove(db_path)
+    return resultados
+
+
+# Arranque en frío de la aplicación, en un proceso nuevo por corrida
+STARTUP_SCRIPT = '''
+import json, sys, time
+inicio = time.perf_counter()
+import app
+importado = time.perf_counter()
+flask_app = app.create_app()
+flask_app.config.update(DB_BACKEND='sqlite', SQLITE_DATABASE=sys.argv[1])
+creado = time.perf_counter()
+status = flask_app.test_client().get('/').status_code
+respondido = time.perf_counter()
+heavy_loaded = 'pandas' in sys.modules
+warmup = app.warmup()
+print(json.dumps({'import_app': round(importado - inicio, 4), 'create_app': round(creado - importado, 4),
+                  'first_request': round(respondido - creado, 4), 'first_request_status': status,
+                  'pandas_loaded_before_warmup': heavy_loaded, 'warmup': round(sum(warmup.values()), 4),
+                  'warmup_modules': warmup}))
+'''
+
+
+def measure_startup(work_dir, runs=3):
+    print(f"Arranque de la aplicación: {runs} corridas")
+    corridas = []
+    for _ in range(runs):
+        inicio = time.perf_counter()
+        proceso = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, os.path.join(work_dir, 'startup.db')], cwd=work_dir,
+                                 env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))),
+                                 capture_output=True, text=True, check=True)
+        corrida = json.loads(proceso.stdout.strip().splitlines()[-1])
+        corrida['process_total'] = round(time.perf_counter() - inicio, 4)
+        print(f"  import {corrida['import_app']:.3f} s, primera solicitud {corrida['first_request']:.3f} s, "
+              f"warmup {corrida['warmup']:.3f} s, proceso {corrida['process_total']:.3f} s")
+        corridas.append(corrida)
+    return corridas
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de transformación y subida de egresos')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--output', default='benchmarks', help='carpeta donde se guarda el JSON de resultados')
+    parser.add_argument('--database', default='transmed.db', help='base SQLite de referencia (se copia, no se modifica)')
+    parser.add_argument('--work-dir', default=None, help='carpeta para los libros generados (se reutilizan entre corridas)')
+    parser.add_argument('--skip', nargs='*', default=[], choices=['xlsx', 'streaming', 'upload', 'startup'])
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark_egresos_')
+    os.makedirs(work_dir, exist_ok=True)
+    informe = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'transform_version': TRANSFORM_VERSION,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'startup': measure_startup(work_dir) if 'startup' not in args.skip else None,
+        'results': [run_size(n, work_dir, args.database, args.skip) for n in args.sizes],
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2)
+    print(f"Resultados guardados en {path}")
+
+
+if __name__ == '__main__':
+    main()
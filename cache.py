@@ -0,0 +1,97 @@
+import hashlib
+import os
+import time
+
+import pandas as pd
+
+# Parquet (columnar) con pyarrow, que está en requirements.txt; sin él, pickle de pandas
+try:
+    import pyarrow  # noqa: F401
+    PARQUET = True
+except ImportError:
+    PARQUET = False
+
+
+# Clave del caché: hash de los bytes del archivo subido más la versión de la transformación
+def file_key(file_path, version):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloque)
+    sha.update(str(version).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _entry_paths(cache_folder, key):
+    return [os.path.join(cache_folder, f'{key}.parquet'), os.path.join(cache_folder, f'{key}.pkl')]
+
+
+# Indicar si hay una entrada guardada para la clave
+def exists(cache_folder, key):
+    return any(os.path.exists(path) for path in _entry_paths(cache_folder, key))
+
+
+# Leer el DataFrame cacheado (None si no existe). Un acierto actualiza la fecha de uso (LRU).
+def load(cache_folder, key):
+    for path in _entry_paths(cache_folder, key):
+        if not os.path.exists(path):
+            continue
+        try:
+            df = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_pickle(path)
+        except Exception:
+            # Entrada incompleta o dañada: se descarta y se vuelve a transformar
+            os.remove(path)
+            return None
+        os.utime(path)
+        return df
+    return None
+
+
+# Guardar el DataFrame en el caché. Se escribe a un temporal y se renombra, para que
+# otro proceso nunca lea una entrada a medio escribir.
+def store(cache_folder, key, df):
+    os.makedirs(cache_folder, exist_ok=True)
+    parquet_path, pickle_path = _entry_paths(cache_folder, key)
+    if PARQUET:
+        tmp_path = f'{parquet_path}.{os.getpid()}.tmp'
+        try:
+            df.to_parquet(tmp_path, index=True)
+            os.replace(tmp_path, parquet_path)
+            return
+        except Exception:
+            # Columnas con tipos mixtos que parquet no admite: se usa pickle
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    tmp_path = f'{pickle_path}.{os.getpid()}.tmp'
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, pickle_path)
+
+
+# Eliminar entradas más antiguas que max_age segundos y luego las de uso menos
+# reciente hasta que el caché ocupe como máximo max_bytes
+def evict(cache_folder, max_bytes, max_age):
+    if not os.path.isdir(cache_folder):
+        return
+    now = time.time()
+    entradas = []
+    for name in os.listdir(cache_folder):
+        if not name.endswith(('.parquet', '.pkl')):
+            continue
+        path = os.path.join(cache_folder, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > max_age:
+            os.remove(path)
+        else:
+            entradas.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entradas)
+    for _, size, path in sorted(entradas):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
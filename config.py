@@ -3,4 +3,40 @@ class Config:
     UPLOAD_FOLDER = 'uploads'
     TRANSFORMED_FOLDER = 'transformed'
     DATABASE = 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=ELVER;DATABASE=Diagnosticos;Trusted_Connection=yes'
-    ALLOWED_EXTENSIONS = {'xls', 'xlsx'}
\ No newline at end of file
+    ALLOWED_EXTENSIONS = {'xls', 'xlsx'}
+    # Base de datos: 'sqlserver' (DATABASE vía pyodbc) o 'sqlite' (SQLITE_DATABASE)
+    DB_BACKEND = 'sqlserver'
+    SQLITE_DATABASE = 'transmed.db'
+    # Carga masiva: filas por lote de executemany y estrategia ('executemany' o 'staging')
+    BULK_BATCH_SIZE = 5000
+    BULK_STRATEGY = 'executemany'
+    # Pool de conexiones: máximo de conexiones, segundos de espera por una libre y verificación al sacarla
+    DB_POOL_MAX_SIZE = 5
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_HEALTH_CHECK = True
+    # Trabajos en segundo plano: procesos para transformar e hilos para subir a la base de datos
+    JOB_PROCESSES = 2
+    JOB_THREADS = 4
+    # Segundos que se conservan las carpetas de salida de cada trabajo (transformed/<job_id>)
+    JOB_OUTPUT_TTL = 24 * 3600
+    # Transformación por lotes (solo .xlsx con salida CSV): filas leídas por lote y orden final opcional
+    TRANSFORM_STREAMING = False
+    TRANSFORM_CHUNK_SIZE = 50000
+    TRANSFORM_SORT = True
+    # Caché de salidas transformadas por hash del archivo subido (evicción LRU por tamaño y antigüedad)
+    TRANSFORM_CACHE = True
+    TRANSFORM_CACHE_FOLDER = 'cache'
+    TRANSFORM_CACHE_MAX_BYTES = 500 * 1024 * 1024
+    TRANSFORM_CACHE_MAX_AGE = 7 * 24 * 3600
+    # Descarga: la transformación escribe el CSV/XLSX y /download lo envía desde el disco por
+    # bloques. Con DOWNLOAD_ON_THE_FLY el CSV no se escribe y se genera en la solicitud desde
+    # el DataFrame del trabajo, que se carga completo en memoria antes del primer byte
+    DOWNLOAD_ON_THE_FLY = False
+    DOWNLOAD_CHUNK_ROWS = 10000
+    # Logs estructurados: nivel y formato ('json' o 'text'); LOG_ROW_DUMPS muestra filas de datos en DEBUG
+    LOG_LEVEL = 'INFO'
+    LOG_FORMAT = 'json'
+    LOG_ROW_DUMPS = False
+    # Perfil cProfile de cada solicitud (archivos .prof en PROFILE_FOLDER), solo para diagnóstico
+    PROFILE_REQUESTS = False
+    PROFILE_FOLDER = 'profiles'
@@ -0,0 +1,464 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+
+# Backend SQL Server (pyodbc), el de producción
+class SQLServerBackend:
+    name = 'SQL Server'
+
+    def __init__(self, conn_str):
+        import pyodbc
+        self.pyodbc = pyodbc
+        self.conn_str = conn_str
+        self.dsn = conn_str
+        self.Error = pyodbc.Error
+
+    def connect(self):
+        return self.pyodbc.connect(self.conn_str)
+
+    def cursor(self, conn):
+        cursor = conn.cursor()
+        # Enviar cada lote de executemany como un solo paquete de parámetros
+        cursor.fast_executemany = True
+        return cursor
+
+    # Tipos genéricos del esquema a tipos de SQL Server
+    types = {'INTEGER': 'INT', 'TEXT': 'NVARCHAR(255)', 'REAL': 'FLOAT'}
+    # Clave de fila para la paginación por clave (columna IDENTITY)
+    row_id = 'id'
+
+    def create_table_sql(self, table, columns_str):
+        return f"IF OBJECT_ID('{table}', 'U') IS NULL CREATE TABLE {table} (id BIGINT IDENTITY(1,1) PRIMARY KEY, {columns_str})"
+
+    # Tablas creadas antes de la columna id (sin clave): se agrega la columna IDENTITY y,
+    # si ningún índice empieza por ella, un índice para la paginación por clave. Lo ejecuta
+    # ensure_schema en la carga, nunca una consulta de lectura.
+    def add_row_id_sql(self, table):
+        return [f"IF COL_LENGTH('{table}', 'id') IS NULL ALTER TABLE {table} ADD id BIGINT IDENTITY(1,1) NOT NULL",
+                f"IF NOT EXISTS (SELECT 1 FROM sys.index_columns ic JOIN sys.columns c ON c.object_id = ic.object_id "
+                f"AND c.column_id = ic.column_id WHERE ic.object_id = OBJECT_ID('{table}') AND ic.key_ordinal = 1 AND c.name = 'id') "
+                f"CREATE INDEX ix_{table}_id ON {table} (id)"]
+
+    def row_id_exists(self, cursor, table):
+        cursor.execute("SELECT COL_LENGTH(?, 'id')", (table,))
+        return cursor.fetchone()[0] is not None
+
+    def paginate_sql(self, columns_str, table, where_sql, order_by, limit):
+        return f"SELECT TOP ({int(limit)}) {columns_str} FROM {table}{where_sql} ORDER BY {order_by}"
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT OBJECT_ID(?, 'U')", (table,))
+        return cursor.fetchone()[0] is not None
+
+    def create_index_sql(self, table, name, columns):
+        return (f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}')) "
+                f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+
+    def create_staging_sql(self, table, columns_str):
+        return f"SELECT TOP 0 {columns_str} INTO #{table}_staging FROM {table}"
+
+    # Tipos de los parámetros de executemany según el esquema; sin esto fast_executemany
+    # los deduce de la primera fila (un NULL o un número en una columna de texto rompe el lote)
+    def input_sizes(self, sql_types):
+        sizes = {'INTEGER': (self.pyodbc.SQL_INTEGER, 0, 0), 'TEXT': (self.pyodbc.SQL_WVARCHAR, 255, 0),
+                 'REAL': (self.pyodbc.SQL_DOUBLE, 0, 0)}
+        return [sizes[sql_type] for sql_type in sql_types]
+
+    def staging_table(self, table):
+        return f"#{table}_staging"
+
+
+# Backend SQLite, para trabajar contra transmed.db sin SQL Server
+class SQLiteBackend:
+    name = 'SQLite'
+    Error = sqlite3.Error
+
+    def __init__(self, path):
+        self.path = path
+        self.dsn = path
+
+    def connect(self):
+        # Las conexiones del pool pasan de un hilo a otro (nunca en uso por dos a la vez)
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    types = {'INTEGER': 'INTEGER', 'TEXT': 'TEXT', 'REAL': 'REAL'}
+    row_id = 'rowid'
+
+    def create_table_sql(self, table, columns_str):
+        return f"CREATE TABLE IF NOT EXISTS {table} ({columns_str})"
+
+    # rowid existe en toda tabla SQLite
+    def add_row_id_sql(self, table):
+        return []
+
+    def row_id_exists(self, cursor, table):
+        return True
+
+    def paginate_sql(self, columns_str, table, where_sql, order_by, limit):
+        return f"SELECT {columns_str} FROM {table}{where_sql} ORDER BY {order_by} LIMIT {int(limit)}"
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        return cursor.fetchone() is not None
+
+    def create_index_sql(self, table, name, columns):
+        return f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+
+    # sqlite3 toma el tipo de cada valor de Python
+    def input_sizes(self, sql_types):
+        return None
+
+    def create_staging_sql(self, table, columns_str):
+        return f"CREATE TEMP TABLE {table}_staging AS SELECT {columns_str} FROM {table} WHERE 0"
+
+    def staging_table(self, table):
+        return f"{table}_staging"
+
+
+# Obtener el backend configurado (DB_BACKEND = 'sqlserver' o 'sqlite')
+def get_backend(config):
+    if config.get('DB_BACKEND', 'sqlserver') == 'sqlite':
+        return SQLiteBackend(config['SQLITE_DATABASE'])
+    return SQLServerBackend(config['DATABASE'])
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Pool de conexiones reutilizables para un backend. Se reutiliza primero la conexión
+# devuelta más recientemente; al sacarla se verifica con SELECT 1 y, si falló, se
+# reemplaza por una nueva. Si ya hay max_size conexiones en uso se espera hasta timeout.
+class ConnectionPool:
+    def __init__(self, backend, max_size=5, timeout=30, health_check=True):
+        self.backend = backend
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check = health_check
+        self._idle = []
+        self._open = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.metrics = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def _healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            return True
+        except self.backend.Error:
+            return False
+
+    def _new_connection(self):
+        try:
+            conn = self.backend.connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.metrics['connections_created'] += 1
+        return conn
+
+    def acquire(self):
+        inicio = time.perf_counter()
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    conn = None
+                    break
+                restante = self.timeout - (time.perf_counter() - inicio)
+                if restante <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeout(f'No hay conexiones libres a {self.backend.name} después de {self.timeout} s')
+                self._cond.wait(restante)
+            self._in_use += 1
+            espera = time.perf_counter() - inicio
+            self.metrics['checkouts'] += 1
+            self.metrics['wait_seconds_total'] += espera
+            self.metrics['wait_seconds_max'] = max(self.metrics['wait_seconds_max'], espera)
+
+        if conn is None:
+            return self._new_connection()
+        if self.health_check and not self._healthy(conn):
+            with self._cond:
+                self.metrics['health_check_failures'] += 1
+                self.metrics['connections_discarded'] += 1
+            try:
+                conn.close()
+            except self.backend.Error:
+                pass
+            return self._new_connection()
+        return conn
+
+    # Devolver la conexión al pool (deshaciendo cualquier transacción abierta) o descartarla
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                conn.rollback()
+            except self.backend.Error:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._open -= 1
+                self.metrics['connections_discarded'] += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if discard:
+            try:
+                conn.close()
+            except self.backend.Error:
+                pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except self.backend.Error:
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.metrics)
+            stats.update({
+                'max_size': self.max_size,
+                'connections_open': self._open,
+                'connections_in_use': self._in_use,
+                'connections_idle': len(self._idle),
+            })
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Pool compartido para la base de datos configurada (uno por backend y cadena de conexión)
+def get_pool(config):
+    backend = get_backend(config)
+    key = (backend.name, backend.dsn)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(backend, config.get('DB_POOL_MAX_SIZE', 5),
+                                         config.get('DB_POOL_TIMEOUT', 30), config.get('DB_POOL_HEALTH_CHECK', True))
+        return _pools[key]
+
+
+# Esquema de la tabla egresos (mismo que transmed.db), en el orden de columnas_salida
+EGRESOS_COLUMNS = {
+    'anio': 'INTEGER', 'mes': 'INTEGER', 'numhc': 'TEXT', 'doc_iden': 'INTEGER',
+    'etnia': 'INTEGER', 'sexo': 'INTEGER', 'edad': 'INTEGER', 'tipoedad': 'INTEGER',
+    'idetareo': 'INTEGER', 'ups': 'INTEGER', 'diag': 'TEXT', 'numdiag': 'INTEGER',
+    'cemorb': 'TEXT', 'numcemorb': 'INTEGER', 'codcpt': 'TEXT', 'numcodcpt': 'INTEGER',
+    'totalest': 'INTEGER', 'nomb': 'TEXT', 'apell': 'TEXT', 'ubigeo': 'INTEGER',
+    'condicion': 'INTEGER',
+}
+
+# Tipo de pandas de cada tipo del esquema: enteros y reales anulables, texto con NA
+PANDAS_TYPES = {'INTEGER': 'Int64', 'REAL': 'Float64', 'TEXT': 'string'}
+
+
+def _to_schema_type(serie, sql_type):
+    # pandas solo se importa al convertir una carga (no al iniciar la aplicación)
+    import pandas as pd
+    if sql_type == 'TEXT':
+        # Números leídos del Excel como float (numhc 12345.0) se guardan sin el '.0'
+        if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+            serie = serie.astype('Int64')
+        # También en columnas mixtas (texto y números: numhc 'A123' y 2.0)
+        elif serie.dtype == object:
+            serie = serie.map(lambda valor: int(valor) if isinstance(valor, float) and valor.is_integer() else valor)
+    elif not pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+        # Solo quedan vacíos: el texto no numérico ya lo rechaza la validación (regla numero)
+        serie = pd.to_numeric(serie, errors='coerce')
+    return serie.astype(PANDAS_TYPES[sql_type])
+
+
+# Convertir las columnas al tipo de EGRESOS_COLUMNS en una sola pasada por columna.
+# Los vacíos (NaN) quedan como NA y se insertan como NULL; las columnas que ya tienen
+# el tipo correcto no se copian.
+def normalize_types(df, columns=EGRESOS_COLUMNS):
+    for column in df.columns:
+        sql_type = columns.get(column, 'TEXT')
+        if df[column].dtype != PANDAS_TYPES[sql_type]:
+            df[column] = _to_schema_type(df[column], sql_type)
+    return df
+
+
+# Índices de la tabla egresos: (nombre, columnas)
+EGRESOS_INDEXES = [
+    ('ix_egresos_anio_mes_numhc', ['anio', 'mes', 'numhc']),
+    # Consultas y agregaciones de /api/egresos por UPS, diagnóstico y grupo de edad
+    ('ix_egresos_anio_mes_ups', ['anio', 'mes', 'ups']),
+    ('ix_egresos_diag_anio_mes', ['diag', 'anio', 'mes']),
+    ('ix_egresos_anio_mes_idetareo', ['anio', 'mes', 'idetareo']),
+]
+
+
+# Crear la tabla egresos (si no existe) y sus índices. Nunca borra datos existentes; a
+# una tabla anterior sin clave de fila (backend.row_id) se le agrega.
+def ensure_schema(backend, conn, table='egresos'):
+    cursor = conn.cursor()
+    columns_str = ', '.join(f"{column} {backend.types[sql_type]}" for column, sql_type in EGRESOS_COLUMNS.items())
+    cursor.execute(backend.create_table_sql(table, columns_str))
+    for sql in backend.add_row_id_sql(table):
+        cursor.execute(sql)
+    for name, columns in EGRESOS_INDEXES:
+        cursor.execute(backend.create_index_sql(table, name, columns))
+    conn.commit()
+
+
+# Contar cuántas filas del DataFrame ya existen en la tabla (misma anio, mes y numhc).
+# Se hace una consulta por partición (anio, mes) que trae los numhc existentes a un
+# conjunto, en lugar de una consulta por fila. Devuelve (existentes, nuevas).
+def count_existing(backend, conn, df, table='egresos'):
+    cursor = conn.cursor()
+    if not backend.table_exists(cursor, table):
+        return 0, len(df)
+    existentes = 0
+    for (anio, mes), particion in df.groupby(['anio', 'mes'], sort=False):
+        cursor.execute(f"SELECT DISTINCT numhc FROM {table} WHERE anio = ? AND mes = ?", (int(anio), int(mes)))
+        claves = {str(fila[0]) for fila in cursor.fetchall()}
+        if claves:
+            existentes += int(particion['numhc'].isin(claves).sum())
+    return existentes, len(df) - existentes
+
+
+# Filas que ya tiene la tabla en cada partición (anio, mes); solo se incluyen las no vacías.
+# Cargar esas particiones las reemplaza completas, así que se pide confirmación antes.
+def count_partition_rows(backend, conn, partitions, table='egresos'):
+    cursor = conn.cursor()
+    if not backend.table_exists(cursor, table):
+        return {}
+    filas = {}
+    for anio, mes in partitions:
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE anio = ? AND mes = ?", (anio, mes))
+        n = cursor.fetchone()[0]
+        if n:
+            filas[(anio, mes)] = n
+    return filas
+
+
+# Particiones (anio, mes) presentes en el DataFrame
+def partitions(df):
+    claves = df[['anio', 'mes']].dropna().drop_duplicates()
+    return [(int(anio), int(mes)) for anio, mes in claves.itertuples(index=False, name=None)]
+
+
+# Recorrer las filas del DataFrame en lotes de tuplas. Cada columna se convierte una sola
+# vez a valores de Python (NA = None, que se envía como NULL) y las filas se arman con zip
+def _lotes(df, batch_size):
+    columnas = [df[column].to_numpy(dtype=object, na_value=None) for column in df.columns]
+    filas = zip(*columnas)
+    while True:
+        lote = list(islice(filas, batch_size))
+        if not lote:
+            break
+        yield lote
+
+
+# Cursor para executemany con los tipos de parámetro de sql_types. pyodbc conserva los tipos
+# fijados en el cursor para todas las consultas siguientes, así que cada inserción tipada usa
+# un cursor propio que se cierra al terminar (en la misma conexión y transacción)
+@contextmanager
+def typed_cursor(backend, conn, sql_types):
+    cursor = backend.cursor(conn)
+    sizes = backend.input_sizes(sql_types)
+    if sizes:
+        cursor.setinputsizes(sizes)
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+# Insertar las filas del DataFrame sin confirmar la transacción. Estrategias:
+# - 'executemany': INSERT directo en la tabla por lotes de batch_size filas
+# - 'staging': lotes a una tabla temporal y luego un único INSERT ... SELECT
+def _insert_rows(backend, conn, cursor, df, table, batch_size, strategy, progress=None):
+    columns_str = ', '.join(df.columns)
+    placeholders = ', '.join(['?' for _ in df.columns])
+    destino = table
+    if strategy == 'staging':
+        cursor.execute(backend.create_staging_sql(table, columns_str))
+        destino = backend.staging_table(table)
+    query = f"INSERT INTO {destino} ({columns_str}) VALUES ({placeholders})"
+    row_count = 0
+    with typed_cursor(backend, conn, [EGRESOS_COLUMNS.get(column, 'TEXT') for column in df.columns]) as insert_cursor:
+        for lote in _lotes(df, batch_size):
+            insert_cursor.executemany(query, lote)
+            row_count += len(lote)
+            if progress:
+                progress(rows=row_count)
+    if strategy == 'staging':
+        cursor.execute(f"INSERT INTO {table} ({columns_str}) SELECT {columns_str} FROM {destino}")
+        cursor.execute(f"DROP TABLE {destino}")
+    return row_count
+
+
+# Carga masiva (solo agrega filas) en una sola transacción.
+# Devuelve (filas insertadas, segundos)
+def bulk_insert(backend, conn, df, table='egresos', batch_size=5000, strategy='executemany'):
+    inicio = time.perf_counter()
+    cursor = backend.cursor(conn)
+    try:
+        row_count = _insert_rows(backend, conn, cursor, df, table, batch_size, strategy)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return row_count, time.perf_counter() - inicio
+
+
+# Cargar el DataFrame reemplazando solo sus particiones (anio, mes): en una única
+# transacción se borran los meses presentes en el archivo y se insertan las filas.
+# Los demás meses de la tabla no se tocan; si algo falla no cambia nada.
+# before_commit(cursor, filas insertadas, {(anio, mes): filas reemplazadas}) se ejecuta
+# dentro de la misma transacción (por ejemplo, para registrar la carga).
+# Devuelve (filas insertadas, filas reemplazadas, segundos)
+def replace_partitions(backend, conn, df, table='egresos', batch_size=5000, strategy='executemany', progress=None, before_commit=None):
+    inicio = time.perf_counter()
+    cursor = backend.cursor(conn)
+    try:
+        replaced = {}
+        for anio, mes in partitions(df):
+            cursor.execute(f"DELETE FROM {table} WHERE anio = ? AND mes = ?", (anio, mes))
+            replaced[(anio, mes)] = max(cursor.rowcount, 0)
+        row_count = _insert_rows(backend, conn, cursor, df, table, batch_size, strategy, progress)
+        if before_commit:
+            before_commit(cursor, row_count, replaced)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return row_count, sum(replaced.values()), time.perf_counter() - inicio
@@ -0,0 +1,29 @@
+import zlib
+
+# Tamaño de los bloques enviados al cliente
+BLOCK_SIZE = 64 * 1024
+
+
+# CSV generado por bloques de filas: la primera parte sale sin esperar al resto
+def iter_csv(df, chunk_rows=10000):
+    yield df.iloc[0:0].to_csv(index=False, encoding='utf-8').encode('utf-8')
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False, encoding='utf-8').encode('utf-8')
+
+
+# Leer un archivo ya generado en bloques
+def iter_file(path):
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(BLOCK_SIZE), b''):
+            yield bloque
+
+
+# Comprimir con gzip un flujo de bloques sin juntarlo en memoria
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        comprimido = compressor.compress(chunk)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
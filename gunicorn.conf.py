@@ -0,0 +1,7 @@
+# Configuración de gunicorn, se lee al ejecutar gunicorn desde esta carpeta (ver wsgi.py).
+# Un solo worker: el registro de trabajos está en su memoria. Las solicitudes simultáneas
+# se atienden con hilos; no subir workers sin antes compartir ese registro entre procesos.
+wsgi_app = 'wsgi:app'
+workers = 1
+threads = 8
+preload_app = True
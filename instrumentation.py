@@ -0,0 +1,200 @@
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Atributos propios de LogRecord; los demás vienen de extra={...} y se emiten como campos
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+# Una línea JSON por evento: fecha, nivel, logger, mensaje y los campos de extra
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        evento = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        evento.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if record.exc_info:
+            evento['exc'] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+# Texto legible: los campos de extra se agregan como clave=valor
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record):
+        linea = super().format(record)
+        campos = ' '.join(f'{key}={value}' for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        return f'{linea} {campos}' if campos else linea
+
+
+# Configurar el logger raíz de la aplicación (LOG_LEVEL y LOG_FORMAT = 'json' o 'text')
+def configure_logging(level='INFO', fmt='json'):
+    handler = logging.StreamHandler()
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(KeyValueFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+
+# Métricas en memoria del proceso Flask con el formato de texto de Prometheus.
+# Las etiquetas se pasan como argumentos con nombre: PHASE_SECONDS.observe(1.2, phase='read')
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _label_str(self, key, extra=()):
+        pares = list(zip(self.labels, key)) + list(extra)
+        if not pares:
+            return ''
+        return '{' + ','.join(f'{label}="{value}"' for label, value in pares) + '}'
+
+    def render(self):
+        lineas = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            lineas.extend(self._render_values())
+        return lineas
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_values(self):
+        return [f'{self.name}{self._label_str(key)} {value}' for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            cuentas, suma, total = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            cuentas = [cuenta + (value <= limite) for cuenta, limite in zip(cuentas, self.buckets)]
+            self._values[key] = (cuentas, suma + value, total + 1)
+
+    def _render_values(self):
+        lineas = []
+        for key, (cuentas, suma, total) in sorted(self._values.items()):
+            for limite, cuenta in zip(self.buckets, cuentas):
+                lineas.append(f'{self.name}_bucket{self._label_str(key, [("le", limite)])} {cuenta}')
+            lineas.append(f'{self.name}_bucket{self._label_str(key, [("le", "+Inf")])} {total}')
+            lineas.append(f'{self.name}_sum{self._label_str(key)} {round(suma, 6)}')
+            lineas.append(f'{self.name}_count{self._label_str(key)} {total}')
+        return lineas
+
+
+# Valores calculados al momento de leer /metrics (por ejemplo, el estado del pool)
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _render_values(self):
+        return [f'{self.name}{self._label_str(key)} {value}' for key, value in sorted(self._values.items())]
+
+
+_registry = []
+
+HTTP_REQUESTS = Counter('transmed_http_requests_total', 'Solicitudes HTTP atendidas', ['method', 'endpoint', 'status'])
+HTTP_SECONDS = Histogram('transmed_http_request_seconds', 'Duración de las solicitudes HTTP', ['endpoint'])
+JOBS = Counter('transmed_jobs_total', 'Trabajos en segundo plano terminados', ['kind', 'status'])
+PHASE_SECONDS = Histogram('transmed_phase_seconds', 'Duración de cada fase (read, validate, transform, serialize, dedup, insert, ...)', ['kind', 'phase'])
+ROWS = Counter('transmed_rows_total', 'Filas procesadas por etapa', ['kind', 'stage'])
+POOL = Gauge('transmed_db_pool', 'Estado del pool de conexiones a la base de datos', ['stat'])
+
+
+# Medir una fase: guarda los segundos en timings[phase] (se suman si la fase se repite)
+@contextmanager
+def phase_timer(timings, phase):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round(timings.get(phase, 0.0) + time.perf_counter() - inicio, 6)
+
+
+# Registrar un trabajo terminado: sus fases (result['timings'], en segundos o listas de
+# segundos) y sus filas. Se llama en el proceso Flask aunque el trabajo corra en otro proceso.
+def record_job(kind, status, result):
+    JOBS.inc(kind=kind, status=status)
+    if not isinstance(result, dict):
+        return
+    for phase, valores in (result.get('timings') or {}).items():
+        for valor in valores if isinstance(valores, list) else [valores]:
+            PHASE_SECONDS.observe(valor, kind=kind, phase=phase)
+    if result.get('rows'):
+        ROWS.inc(result['rows'], kind=kind, stage='ok')
+    if result.get('rejected_rows'):
+        ROWS.inc(result['rejected_rows'], kind=kind, stage='rejected')
+
+
+# Recorrer un flujo de bloques midiendo el tiempo de generarlos; la fase se registra al terminar
+def timed_stream(chunks, kind, phase):
+    total = 0.0
+    iterador = iter(chunks)
+    while True:
+        inicio = time.perf_counter()
+        try:
+            chunk = next(iterador)
+        except StopIteration:
+            total += time.perf_counter() - inicio
+            break
+        total += time.perf_counter() - inicio
+        yield chunk
+    PHASE_SECONDS.observe(total, kind=kind, phase=phase)
+
+
+# Texto de /metrics
+def render_metrics():
+    lineas = []
+    for metric in _registry:
+        lineas.extend(metric.render())
+    return '\n'.join(lineas) + '\n'
+
+
+# Perfil de una solicitud con cProfile, guardado en folder/<fecha>_<endpoint>.prof
+class RequestProfiler:
+    def __init__(self, folder):
+        self.folder = folder
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, endpoint):
+        self.profile.disable()
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"{datetime.now():%Y%m%d_%H%M%S_%f}_{endpoint or 'sin_ruta'}.prof")
+        self.profile.dump_stats(path)
+        return path
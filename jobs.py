@@ -0,0 +1,184 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import Manager
+
+from instrumentation import record_job
+
+logger = logging.getLogger(__name__)
+
+# Registro de trabajos en memoria del proceso Flask: job_id -> estado. No se comparte entre
+# procesos, por eso el servidor corre con un solo worker (ver wsgi.py)
+_jobs = {}
+_lock = threading.Lock()
+
+_process_pool = None
+_thread_pool = None
+_manager = None
+_progress_queue = None
+_pool_sizes = (2, 4)
+_pools_lock = threading.Lock()
+
+
+# Tamaño de los pools: procesos para transform_excel (CPU) e hilos para la base de datos (E/S).
+# Los pools se crean con el primer trabajo del proceso, así en un servidor con prefork
+# cada worker crea los suyos y el proceso maestro no arranca procesos ni hilos antes del fork.
+def configure_pools(max_processes=2, max_threads=4):
+    global _pool_sizes
+    _pool_sizes = (max_processes, max_threads)
+
+
+# Crear los pools si todavía no existen. El progreso de los procesos hijos llega por una
+# cola compartida que lee un hilo aparte.
+def init_pools():
+    global _process_pool, _thread_pool, _manager, _progress_queue
+    with _pools_lock:
+        if _process_pool is not None:
+            return
+        max_processes, max_threads = _pool_sizes
+        _manager = Manager()
+        _progress_queue = _manager.Queue()
+        _process_pool = ProcessPoolExecutor(max_workers=max_processes)
+        _thread_pool = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='job-db')
+        threading.Thread(target=_drain_progress, name='job-progress', daemon=True).start()
+
+
+def _drain_progress():
+    while True:
+        try:
+            job_id, fields = _progress_queue.get()
+        except (EOFError, OSError):
+            # El Manager se cerró al terminar el proceso
+            return
+        # Un aviso de progreso puede llegar después de que el trabajo terminó
+        with _lock:
+            job = _jobs.get(job_id)
+            if job and job['finished'] is None:
+                job.update(fields)
+
+
+# Reportar progreso desde un proceso hijo (se puede serializar con pickle)
+class QueueProgress:
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def __call__(self, **fields):
+        self.queue.put((self.job_id, fields))
+
+
+# Reportar progreso desde un hilo del mismo proceso
+class LocalProgress:
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def __call__(self, **fields):
+        update_job(self.job_id, **fields)
+
+
+def create_job(kind):
+    job_id = uuid.uuid4().hex
+    with _lock:
+        _jobs[job_id] = {
+            'id': job_id,
+            'kind': kind,
+            'status': 'pendiente',
+            'phase': 'en cola',
+            'rows': 0,
+            'result': None,
+            'error': None,
+            'created': time.time(),
+            'finished': None,
+        }
+    return job_id
+
+
+def update_job(job_id, **fields):
+    with _lock:
+        if job_id in _jobs:
+            _jobs[job_id].update(fields)
+
+
+# Copia del estado del trabajo (None si no existe)
+def get_job(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+# Al terminar se guarda el resultado y se registran sus métricas (fases y filas)
+def _on_done(job_id):
+    def callback(future):
+        kind = (get_job(job_id) or {}).get('kind')
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.exception('trabajo con error', extra={'job_id': job_id, 'kind': kind})
+            update_job(job_id, status='error', phase='error', error=str(e), finished=time.time())
+            record_job(kind, 'error', None)
+        else:
+            update_job(job_id, status='completado', phase='completado', result=result, finished=time.time())
+            record_job(kind, 'completado', result)
+            logger.info('trabajo completado', extra={'job_id': job_id, 'kind': kind,
+                                                     'timings': result.get('timings') if isinstance(result, dict) else None})
+    return callback
+
+
+def _submit(pool, job_id, fn, progress, args):
+    update_job(job_id, status='en proceso')
+    future = pool.submit(fn, progress, *args)
+    future.add_done_callback(_on_done(job_id))
+    return job_id
+
+
+# Ejecutar fn(progress, *args) en el pool de procesos para un trabajo creado con
+# create_job; fn debe ser una función de módulo
+def submit_process(job_id, fn, *args):
+    init_pools()
+    return _submit(_process_pool, job_id, fn, QueueProgress(_progress_queue, job_id), args)
+
+
+# Ejecutar fn(progress, *args) en el pool de hilos para un trabajo creado con create_job
+def submit_thread(job_id, fn, *args):
+    init_pools()
+    return _submit(_thread_pool, job_id, fn, LocalProgress(job_id), args)
+
+
+# Ejecutar fn(*args) en el pool de procesos como parte de otro trabajo (por ejemplo, cada
+# libro de un lote); devuelve el Future para esperar su resultado
+def submit_task(fn, *args):
+    init_pools()
+    return _process_pool.submit(fn, *args)
+
+
+# Carpeta propia de los archivos generados por un trabajo
+def job_folder(base_folder, job_id):
+    folder = os.path.join(base_folder, job_id)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+# Eliminar las carpetas de trabajos con más de ttl segundos de antigüedad y, con ellas,
+# los trabajos terminados hace más de ttl segundos del registro en memoria
+def cleanup_job_folders(base_folder, ttl):
+    now = time.time()
+    for name in os.listdir(base_folder):
+        path = os.path.join(base_folder, name)
+        if os.path.isdir(path) and now - os.path.getmtime(path) > ttl:
+            shutil.rmtree(path, ignore_errors=True)
+    prune_jobs(ttl, now)
+
+
+# Quitar del registro los trabajos terminados hace más de ttl segundos (los pendientes
+# y en proceso se conservan)
+def prune_jobs(ttl, now=None):
+    now = time.time() if now is None else now
+    with _lock:
+        vencidos = [job_id for job_id, job in _jobs.items() if job['finished'] is not None and now - job['finished'] > ttl]
+        for job_id in vencidos:
+            del _jobs[job_id]
+    return len(vencidos)
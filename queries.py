@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+
+from db import EGRESOS_COLUMNS
+from summaries import summary_for
+
+# Filtros admitidos en /api/egresos y /api/egresos/resumen
+FILTER_COLUMNS = ['anio', 'mes', 'ups', 'diag', 'sexo', 'idetareo']
+
+# Columnas por las que se puede agrupar
+GROUP_COLUMNS = ['anio', 'mes', 'ups', 'diag', 'sexo', 'idetareo', 'condicion', 'numdiag']
+
+MAX_PAGE_SIZE = 1000
+
+
+class QueryError(ValueError):
+    pass
+
+
+# Convertir los filtros de la URL (un valor o varios separados por coma) en
+# condiciones WHERE con parámetros
+def build_filters(args):
+    condiciones = []
+    params = []
+    filtros = {}
+    for column in FILTER_COLUMNS:
+        raw = args.get(column)
+        if raw is None or raw == '':
+            continue
+        valores = [valor.strip() for valor in str(raw).split(',') if valor.strip()]
+        if EGRESOS_COLUMNS[column] == 'INTEGER':
+            try:
+                valores = [int(valor) for valor in valores]
+            except ValueError:
+                raise QueryError(f'El filtro {column} debe ser numérico')
+        if len(valores) == 1:
+            condiciones.append(f"{column} = ?")
+        else:
+            condiciones.append(f"{column} IN ({', '.join('?' for _ in valores)})")
+        params.extend(valores)
+        filtros[column] = valores
+    return condiciones, params, filtros
+
+
+# Particiones (anio, mes) de las que depende una consulta; None si puede tocar cualquiera
+def _partitions(filtros):
+    if 'anio' in filtros and 'mes' in filtros:
+        return {(anio, mes) for anio in filtros['anio'] for mes in filtros['mes']}
+    return None
+
+
+# Caché en memoria de resultados (LRU con expiración). Cada entrada recuerda las
+# particiones (anio, mes) que leyó para poder invalidarla cuando se recarga o
+# elimina uno de esos meses. Es local a cada proceso; ttl limita cuánto puede
+# quedar desactualizada una entrada si otro proceso cambió los datos.
+# Cada invalidación sube un contador de generación: una consulta toma generation()
+# antes de leer la base y set() descarta su resultado si entretanto se invalidó
+# alguna de sus particiones (leyó datos anteriores a la carga).
+class ResultCache:
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated = {}
+        self._cleared = 0
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entrada = self._entries.get(key)
+            if entrada is None:
+                return None
+            creado, _, valor = entrada
+            if time.time() - creado > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return valor
+
+    def set(self, key, partitions, valor, generation=None):
+        with self._lock:
+            if generation is not None and self._stale(partitions, generation):
+                return
+            self._entries[key] = (time.time(), partitions, valor)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Alguna invalidación posterior a generation afecta a estas particiones
+    def _stale(self, partitions, generation):
+        if partitions is None or self._cleared > generation:
+            return self._generation != generation
+        return any(self._invalidated.get(particion, 0) > generation for particion in partitions)
+
+    # Eliminar las entradas que pueden incluir la partición (anio, mes)
+    def invalidate(self, anio, mes):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[(anio, mes)] = self._generation
+            for key in [key for key, (_, partitions, _) in self._entries.items()
+                        if partitions is None or (anio, mes) in partitions]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._entries.clear()
+
+
+result_cache = ResultCache()
+
+
+def _rows(cursor):
+    columnas = [descripcion[0] for descripcion in cursor.description]
+    return [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+
+
+# Página de registros con paginación por clave: se devuelven las filas con clave de
+# fila mayor que after, en orden, y el cursor para pedir la siguiente página
+def list_egresos(backend, conn, args, table='egresos'):
+    condiciones, params, filtros = build_filters(args)
+    try:
+        limit = min(int(args.get('limit', 100)), MAX_PAGE_SIZE)
+        after = args.get('after')
+        after = int(after) if after not in (None, '') else None
+    except ValueError:
+        raise QueryError('limit y after deben ser numéricos')
+    if limit <= 0:
+        raise QueryError('limit debe ser mayor que cero')
+    if after is not None:
+        condiciones.append(f"{backend.row_id} > ?")
+        params.append(after)
+
+    key = ('list', tuple(condiciones), tuple(params), limit)
+    generation = result_cache.generation()
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    cursor = conn.cursor()
+    # Sin tabla (ninguna carga todavía) no hay filas. A una tabla anterior sin clave de fila
+    # se la agrega la próxima carga (ensure_schema), no esta consulta de lectura.
+    if not backend.table_exists(cursor, table):
+        return {'rows': [], 'next_cursor': None}
+    if not backend.row_id_exists(cursor, table):
+        raise QueryError(f'La tabla {table} todavía no tiene la columna {backend.row_id} para paginar; '
+                         f'se agrega con la próxima carga a la base de datos')
+    where_sql = f" WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    columns_str = ', '.join([f"{backend.row_id} AS id"] + list(EGRESOS_COLUMNS))
+    cursor.execute(backend.paginate_sql(columns_str, table, where_sql, backend.row_id, limit), params)
+    rows = _rows(cursor)
+    result = {'rows': rows, 'next_cursor': rows[-1]['id'] if len(rows) == limit else None}
+    result_cache.set(key, _partitions(filtros), result, generation)
+    return result
+
+
+# Conteos agrupados calculados en la base de datos: casos (filas de diagnóstico)
+# y pacientes distintos (numhc) por cada combinación de group_by. Si una tabla de
+# resumen responde la consulta exactamente (ver summaries.summary_for) se lee de
+# ella en lugar de recorrer egresos.
+def aggregate_egresos(backend, conn, args, table='egresos'):
+    condiciones, params, filtros = build_filters(args)
+    group_by = [column.strip() for column in str(args.get('group_by', 'anio,mes')).split(',') if column.strip()]
+    invalidas = [column for column in group_by if column not in GROUP_COLUMNS]
+    if not group_by or invalidas:
+        raise QueryError(f"group_by admite: {', '.join(GROUP_COLUMNS)}")
+
+    key = ('aggregate', tuple(condiciones), tuple(params), tuple(group_by))
+    generation = result_cache.generation()
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    where_sql = f" WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    group_str = ', '.join(group_by)
+    cursor = conn.cursor()
+    summary = summary_for(group_by, filtros)
+    if summary is not None and backend.table_exists(cursor, summary):
+        cursor.execute(f"SELECT {group_str}, casos, pacientes FROM {summary}{where_sql} ORDER BY {group_str}", params)
+        rows = _rows(cursor)
+    elif backend.table_exists(cursor, table):
+        cursor.execute(f"SELECT {group_str}, COUNT(*) AS casos, COUNT(DISTINCT numhc) AS pacientes "
+                       f"FROM {table}{where_sql} GROUP BY {group_str} ORDER BY {group_str}", params)
+        rows = _rows(cursor)
+    else:
+        # Ninguna carga todavía
+        rows = []
+    result = {'group_by': group_by, 'rows': rows}
+    result_cache.set(key, _partitions(filtros), result, generation)
+    return result
@@ -0,0 +1,128 @@
+import hashlib
+from datetime import datetime
+
+from summaries import delete_summaries
+
+# Registro de cargas a la base de datos. Cada carga (identificada por el id del trabajo
+# de subida) guarda archivo, hash del contenido, rango anio/mes, filas, fechas y duración.
+# cargas_particiones indica qué carga es dueña de cada partición (anio, mes) de egresos:
+# al reemplazar un mes pasa a la carga nueva, y eliminar una carga borra solo los meses
+# que todavía le pertenecen.
+CARGAS_COLUMNS = {
+    'carga_id': 'TEXT', 'archivo': 'TEXT', 'hash': 'TEXT',
+    'anio_desde': 'INTEGER', 'mes_desde': 'INTEGER', 'anio_hasta': 'INTEGER', 'mes_hasta': 'INTEGER',
+    'filas': 'INTEGER', 'filas_reemplazadas': 'INTEGER',
+    'inicio': 'TEXT', 'fin': 'TEXT', 'duracion': 'REAL',
+    'estado': 'TEXT', 'eliminado': 'TEXT',
+}
+
+PARTICIONES_COLUMNS = {'carga_id': 'TEXT', 'anio': 'INTEGER', 'mes': 'INTEGER'}
+
+REGISTRY_INDEXES = [
+    ('cargas', 'ix_cargas_carga_id', ['carga_id']),
+    ('cargas', 'ix_cargas_hash_estado', ['hash', 'estado']),
+    ('cargas', 'ix_cargas_estado_inicio', ['estado', 'inicio']),
+    ('cargas_particiones', 'ix_cargas_particiones_anio_mes', ['anio', 'mes']),
+    ('cargas_particiones', 'ix_cargas_particiones_carga_id', ['carga_id']),
+]
+
+# Estados de una carga
+ACTIVA = 'activa'
+REEMPLAZADA = 'reemplazada'
+ELIMINADA = 'eliminada'
+
+
+# Hash del contenido de un DataFrame cargado (detecta el mismo archivo subido de nuevo)
+def calculate_dataframe_hash(df):
+    import pandas as pd
+    return hashlib.md5(pd.util.hash_pandas_object(df).values.tobytes()).hexdigest()
+
+
+# Crear las tablas del registro y sus índices (si no existen)
+def ensure_registry(backend, conn):
+    cursor = conn.cursor()
+    for table, columns in (('cargas', CARGAS_COLUMNS), ('cargas_particiones', PARTICIONES_COLUMNS)):
+        columns_str = ', '.join(f"{column} {backend.types[sql_type]}" for column, sql_type in columns.items())
+        cursor.execute(backend.create_table_sql(table, columns_str))
+    for table, name, columns in REGISTRY_INDEXES:
+        cursor.execute(backend.create_index_sql(table, name, columns))
+    conn.commit()
+
+
+def _rows(cursor):
+    columnas = [descripcion[0] for descripcion in cursor.description]
+    return [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+
+
+# Carga activa con el mismo hash de contenido (None si el archivo no se cargó antes)
+def find_by_hash(backend, conn, content_hash):
+    cursor = conn.cursor()
+    if not backend.table_exists(cursor, 'cargas'):
+        return None
+    cursor.execute("SELECT carga_id, archivo, inicio FROM cargas WHERE hash = ? AND estado = ?", (content_hash, ACTIVA))
+    rows = _rows(cursor)
+    return rows[0] if rows else None
+
+
+# Registrar una carga con el cursor de su transacción (no confirma): toma la propiedad de
+# sus particiones y marca como reemplazadas las cargas anteriores que se quedan sin ninguna
+def register_load(cursor, carga_id, archivo, content_hash, partitions, filas, filas_reemplazadas, inicio, fin):
+    anteriores = set()
+    for anio, mes in partitions:
+        cursor.execute("SELECT DISTINCT carga_id FROM cargas_particiones WHERE anio = ? AND mes = ?", (anio, mes))
+        anteriores.update(fila[0] for fila in cursor.fetchall())
+        cursor.execute("DELETE FROM cargas_particiones WHERE anio = ? AND mes = ?", (anio, mes))
+    cursor.executemany("INSERT INTO cargas_particiones (carga_id, anio, mes) VALUES (?, ?, ?)",
+                       [(carga_id, anio, mes) for anio, mes in partitions])
+    for anterior in anteriores - {carga_id}:
+        cursor.execute("SELECT COUNT(*) FROM cargas_particiones WHERE carga_id = ?", (anterior,))
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("UPDATE cargas SET estado = ? WHERE carga_id = ?", (REEMPLAZADA, anterior))
+
+    desde = min(partitions) if partitions else (None, None)
+    hasta = max(partitions) if partitions else (None, None)
+    columns_str = ', '.join(CARGAS_COLUMNS)
+    placeholders = ', '.join(['?' for _ in CARGAS_COLUMNS])
+    cursor.execute(f"INSERT INTO cargas ({columns_str}) VALUES ({placeholders})",
+                   (carga_id, archivo, content_hash, desde[0], desde[1], hasta[0], hasta[1],
+                    filas, filas_reemplazadas, inicio.isoformat(timespec='seconds'), fin.isoformat(timespec='seconds'),
+                    round((fin - inicio).total_seconds(), 3), ACTIVA, None))
+
+
+# Cargas activas, la más reciente primero
+def list_loads(backend, conn, limit=50):
+    cursor = conn.cursor()
+    if not backend.table_exists(cursor, 'cargas'):
+        return []
+    columns_str = ', '.join(CARGAS_COLUMNS)
+    cursor.execute(backend.paginate_sql(columns_str, 'cargas', ' WHERE estado = ?', 'inicio DESC', limit), (ACTIVA,))
+    return _rows(cursor)
+
+
+# Eliminar una carga activa y las filas de egresos (y de las tablas de resumen) de las
+# particiones que todavía le pertenecen, en una sola transacción. Devuelve (carga, filas eliminadas, particiones)
+# o None si la carga no existe o ya no está activa.
+def delete_load(backend, conn, carga_id, table='egresos'):
+    cursor = conn.cursor()
+    if not backend.table_exists(cursor, 'cargas'):
+        return None
+    cursor.execute(f"SELECT {', '.join(CARGAS_COLUMNS)} FROM cargas WHERE carga_id = ? AND estado = ?", (carga_id, ACTIVA))
+    rows = _rows(cursor)
+    if not rows:
+        return None
+    try:
+        cursor.execute("SELECT anio, mes FROM cargas_particiones WHERE carga_id = ?", (carga_id,))
+        partitions = [(int(anio), int(mes)) for anio, mes in cursor.fetchall()]
+        rows_affected = 0
+        for anio, mes in partitions:
+            cursor.execute(f"DELETE FROM {table} WHERE anio = ? AND mes = ?", (anio, mes))
+            rows_affected += max(cursor.rowcount, 0)
+        delete_summaries(backend, cursor, partitions)
+        cursor.execute("DELETE FROM cargas_particiones WHERE carga_id = ?", (carga_id,))
+        cursor.execute("UPDATE cargas SET estado = ?, eliminado = ? WHERE carga_id = ?",
+                       (ELIMINADA, datetime.now().isoformat(timespec='seconds'), carga_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows[0], rows_affected, partitions
@@ -0,0 +1,84 @@
+from db import EGRESOS_COLUMNS, partitions, typed_cursor
+
+# Tablas de resumen mensual de egresos: casos (filas) y pacientes distintos (numhc) por
+# anio, mes y la dimensión de cada tabla. Como cada carga reemplaza meses completos, se
+# mantienen por partición (anio, mes): al cargar un mes se reemplazan sus filas con los
+# conteos calculados del DataFrame cargado y al eliminarlo se borran, siempre dentro de
+# la transacción de la carga o de la eliminación.
+SUMMARIES = {
+    'resumen_mes': [],
+    'resumen_diag': ['diag'],
+    'resumen_ups': ['ups'],
+    'resumen_idetareo': ['idetareo'],
+    'resumen_condicion': ['condicion'],
+}
+
+
+def _columns(dimensiones):
+    columns = {'anio': 'INTEGER', 'mes': 'INTEGER'}
+    columns.update({column: EGRESOS_COLUMNS[column] for column in dimensiones})
+    columns.update({'casos': 'INTEGER', 'pacientes': 'INTEGER'})
+    return columns
+
+
+# Crear las tablas de resumen y sus índices (si no existen). Una tabla nueva se llena una
+# sola vez con lo que ya hay en egresos; después solo se actualiza por partición.
+def ensure_summaries(backend, conn, table='egresos'):
+    cursor = conn.cursor()
+    origen = backend.table_exists(cursor, table)
+    for summary, dimensiones in SUMMARIES.items():
+        existe = backend.table_exists(cursor, summary)
+        columns = _columns(dimensiones)
+        columns_str = ', '.join(f"{column} {backend.types[sql_type]}" for column, sql_type in columns.items())
+        cursor.execute(backend.create_table_sql(summary, columns_str))
+        cursor.execute(backend.create_index_sql(summary, f'ix_{summary}_anio_mes', ['anio', 'mes'] + dimensiones))
+        if not existe and origen:
+            group_str = ', '.join(['anio', 'mes'] + dimensiones)
+            cursor.execute(f"INSERT INTO {summary} ({', '.join(columns)}) "
+                           f"SELECT {group_str}, COUNT(*), COUNT(DISTINCT numhc) FROM {table} "
+                           f"WHERE anio IS NOT NULL AND mes IS NOT NULL GROUP BY {group_str}")
+    conn.commit()
+
+
+# Conteos de una tabla de resumen calculados del DataFrame que se está cargando
+def summarize(df, dimensiones):
+    resumen = df.groupby(['anio', 'mes'] + dimensiones, dropna=False, sort=False)['numhc'].agg(['size', 'nunique'])
+    return resumen.reset_index().dropna(subset=['anio', 'mes'])
+
+
+# Reemplazar en las tablas de resumen las particiones (anio, mes) del DataFrame, dentro de
+# la transacción de la carga en conn (no confirma)
+def update_summaries(backend, conn, df):
+    cursor = conn.cursor()
+    particiones = partitions(df)
+    for summary, dimensiones in SUMMARIES.items():
+        for anio, mes in particiones:
+            cursor.execute(f"DELETE FROM {summary} WHERE anio = ? AND mes = ?", (anio, mes))
+        resumen = summarize(df, dimensiones)
+        if not len(resumen):
+            continue
+        columns = _columns(dimensiones)
+        filas = zip(*[resumen[column].to_numpy(dtype=object, na_value=None) for column in resumen.columns])
+        with typed_cursor(backend, conn, list(columns.values())) as insert_cursor:
+            insert_cursor.executemany(f"INSERT INTO {summary} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                                      list(filas))
+
+
+# Borrar de las tablas de resumen las particiones eliminadas (no confirma)
+def delete_summaries(backend, cursor, partitions):
+    for summary in SUMMARIES:
+        if not backend.table_exists(cursor, summary):
+            continue
+        for anio, mes in partitions:
+            cursor.execute(f"DELETE FROM {summary} WHERE anio = ? AND mes = ?", (anio, mes))
+
+
+# Tabla de resumen que responde exactamente una consulta agrupada: group_by debe ser
+# anio, mes y las dimensiones de la tabla, y los filtros solo sobre esas columnas.
+# None si hay que calcularla sobre egresos.
+def summary_for(group_by, filtros):
+    for summary, dimensiones in SUMMARIES.items():
+        columnas = {'anio', 'mes', *dimensiones}
+        if set(group_by) == columnas and set(filtros) <= columnas:
+            return summary
+    return None
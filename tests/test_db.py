@@ -0,0 +1,119 @@
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from db import EGRESOS_COLUMNS, SQLiteBackend, SQLServerBackend, ensure_schema, normalize_types, replace_partitions
+from registry import ensure_registry, register_load
+from summaries import ensure_summaries, update_summaries
+
+
+# Cursor que anota cada consulta con los tipos de parámetro fijados en ese momento.
+# Como pyodbc, conserva los tipos hasta que se vuelven a fijar.
+class RecordingCursor:
+    def __init__(self, cursor, log):
+        self._cursor = cursor
+        self._log = log
+        self.sizes = None
+
+    def setinputsizes(self, sizes):
+        self.sizes = sizes
+
+    def execute(self, sql, params=()):
+        self._log.append((sql, self.sizes))
+        self._cursor.execute(sql, params)
+        return self
+
+    def executemany(self, sql, rows):
+        self._log.append((sql, self.sizes))
+        self._cursor.executemany(sql, rows)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class RecordingConnection:
+    def __init__(self, conn):
+        self._conn = conn
+        self.log = []
+
+    def cursor(self):
+        return RecordingCursor(self._conn.cursor(), self.log)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+
+# SQLite con tipos de parámetro como los del backend SQL Server
+class SizedBackend(SQLiteBackend):
+    def input_sizes(self, sql_types):
+        return list(sql_types)
+
+
+def _egresos(n=4):
+    df = pd.DataFrame({column: [1] * n if sql_type == 'INTEGER' else ['x'] * n for column, sql_type in EGRESOS_COLUMNS.items()})
+    df['anio'] = 2025
+    df['mes'] = 1
+    df['numhc'] = [f'{i:08d}' for i in range(n)]
+    return normalize_types(df)
+
+
+def test_registry_writes_do_not_inherit_input_sizes():
+    backend = SizedBackend(':memory:')
+    conn = RecordingConnection(sqlite3.connect(':memory:'))
+    ensure_schema(backend, conn)
+    ensure_registry(backend, conn)
+    ensure_summaries(backend, conn)
+    df = _egresos()
+
+    def registrar(cursor, rows, replaced):
+        update_summaries(backend, conn, df)
+        register_load(cursor, 'a1b2c3', 'enero.xlsx', 'hash', [(2025, 1)], rows, 0, datetime.now(), datetime.now())
+
+    row_count, _, _ = replace_partitions(backend, conn, df, before_commit=registrar)
+
+    assert row_count == len(df)
+    tipadas = [(sql, sizes) for sql, sizes in conn.log if sizes is not None]
+    assert tipadas
+    for sql, sizes in tipadas:
+        assert sql.startswith(('INSERT INTO egresos', 'INSERT INTO resumen_'))
+        assert len(sizes) == sql.count('?')
+    assert [sql for sql, sizes in conn.log if 'cargas' in sql and sizes is not None] == []
+    assert conn._conn.execute('SELECT carga_id FROM cargas_particiones').fetchall() == [('a1b2c3',)]
+
+
+# numhc mezcla texto y números leídos como float: los enteros se guardan sin '.0'
+def test_normalize_types_mixed_text_column():
+    df = pd.DataFrame({'numhc': pd.Series(['A123', 2.0, None, 45.5], dtype=object), 'edad': [30.0, None, 1.0, 2.0]})
+
+    df = normalize_types(df)
+
+    assert df['numhc'].tolist() == ['A123', '2', pd.NA, '45.5']
+    assert df['edad'].tolist() == [30, pd.NA, 1, 2]
+
+
+# Tabla egresos creada antes de la columna id (SQL Server): ensure_schema la agrega
+def test_ensure_schema_adds_row_id_to_existing_table():
+    # Sin conexión (ni pyodbc): solo se registran las sentencias
+    backend = SQLServerBackend.__new__(SQLServerBackend)
+    log = []
+
+    class Cursor:
+        def execute(self, sql, params=()):
+            log.append(sql)
+
+    class Connection:
+        def cursor(self):
+            return Cursor()
+
+        def commit(self):
+            pass
+
+    ensure_schema(backend, Connection())
+
+    assert any(sql.startswith("IF COL_LENGTH('egresos', 'id') IS NULL ALTER TABLE egresos ADD id BIGINT IDENTITY") for sql in log)
+    assert any('CREATE INDEX ix_egresos_id ON egresos (id)' in sql for sql in log)
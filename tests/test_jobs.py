@@ -0,0 +1,18 @@
+import time
+
+import jobs
+
+
+def test_cleanup_prunes_finished_jobs(tmp_path):
+    viejo = jobs.create_job('transform')
+    reciente = jobs.create_job('transform')
+    en_proceso = jobs.create_job('upload')
+    jobs.update_job(viejo, status='completado', finished=time.time() - 7200)
+    jobs.update_job(reciente, status='completado', finished=time.time())
+    jobs.update_job(en_proceso, status='en proceso', created=time.time() - 7200)
+
+    jobs.cleanup_job_folders(str(tmp_path), 3600)
+
+    assert jobs.get_job(viejo) is None
+    assert jobs.get_job(reciente) is not None
+    assert jobs.get_job(en_proceso) is not None
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeError(Exception):
+    pass
+
+
+# Conexión de prueba: broken hace fallar el SELECT 1 del chequeo de salud
+class FakeConnection:
+    def __init__(self, numero):
+        self.numero = numero
+        self.broken = False
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        if self.broken:
+            raise FakeError('conexión cortada')
+
+    def fetchone(self):
+        return (1,)
+
+    def rollback(self):
+        if self.broken:
+            raise FakeError('conexión cortada')
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBackend:
+    name = 'Fake'
+    Error = FakeError
+
+    def __init__(self):
+        self.connections = []
+        self.fail_connect = False
+
+    def connect(self):
+        if self.fail_connect:
+            raise FakeError('servidor no disponible')
+        conn = FakeConnection(len(self.connections))
+        self.connections.append(conn)
+        return conn
+
+
+def test_acquire_times_out_when_pool_is_full():
+    pool = ConnectionPool(FakeBackend(), max_size=1, timeout=0.1)
+    pool.acquire()
+
+    inicio = time.perf_counter()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    assert time.perf_counter() - inicio >= 0.1
+    assert pool.stats()['timeouts'] == 1
+    assert pool.stats()['connections_in_use'] == 1
+
+
+# Un hilo que espera recibe la conexión que otro devuelve, sin abrir una nueva
+def test_waiter_gets_released_connection():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, max_size=1, timeout=5)
+    conn = pool.acquire()
+    obtenida = []
+    espera = threading.Thread(target=lambda: obtenida.append(pool.acquire()))
+    espera.start()
+    time.sleep(0.05)
+
+    pool.release(conn)
+    espera.join(timeout=5)
+
+    assert obtenida == [conn]
+    assert len(backend.connections) == 1
+    assert pool.stats()['wait_seconds_max'] > 0
+
+
+# Un error del driver dentro de connection() descarta la conexión y libera su lugar
+def test_driver_error_discards_connection():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, max_size=1, timeout=0.1)
+
+    with pytest.raises(FakeError):
+        with pool.connection():
+            raise FakeError('error de la base de datos')
+
+    assert backend.connections[0].closed
+    stats = pool.stats()
+    assert (stats['connections_open'], stats['connections_in_use'], stats['connections_discarded']) == (0, 0, 1)
+    assert pool.acquire() is backend.connections[1]
+
+
+# Una conexión inactiva que dejó de responder se reemplaza al sacarla del pool
+def test_health_check_replaces_dead_connection():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, max_size=1, timeout=0.1)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.broken = True
+
+    nueva = pool.acquire()
+
+    assert nueva is not conn and conn.closed
+    stats = pool.stats()
+    assert (stats['health_check_failures'], stats['connections_open'], stats['connections_created']) == (1, 1, 2)
+
+
+# Si no se puede abrir la conexión el lugar reservado se libera
+def test_failed_connect_frees_slot():
+    backend = FakeBackend()
+    pool = ConnectionPool(backend, max_size=1, timeout=0.1)
+    backend.fail_connect = True
+
+    with pytest.raises(FakeError):
+        pool.acquire()
+
+    backend.fail_connect = False
+    assert pool.acquire() is backend.connections[0]
+    assert pool.stats()['connections_open'] == 1
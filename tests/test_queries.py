@@ -0,0 +1,37 @@
+import sqlite3
+
+from db import SQLiteBackend
+from queries import ResultCache, aggregate_egresos, list_egresos, result_cache
+
+
+# Antes de la primera carga no existe egresos: las consultas devuelven vacío sin crear
+# tablas (el esquema lo crea la carga)
+def test_queries_before_first_load():
+    result_cache.clear()
+    backend = SQLiteBackend(':memory:')
+    conn = sqlite3.connect(':memory:')
+
+    assert list_egresos(backend, conn, {}) == {'rows': [], 'next_cursor': None}
+    assert aggregate_egresos(backend, conn, {'group_by': 'anio,mes'}) == {'group_by': ['anio', 'mes'], 'rows': []}
+    assert aggregate_egresos(backend, conn, {'group_by': 'anio,mes,ups'})['rows'] == []
+    assert conn.execute("SELECT name FROM sqlite_master").fetchall() == []
+
+
+# Una consulta que leyó la base antes de que una carga confirmara no debe quedar en caché
+# si la invalidación de su mes llegó antes que su set()
+def test_cache_discards_results_read_before_invalidation():
+    cache = ResultCache()
+    generation = cache.generation()
+    cache.invalidate(2025, 1)
+
+    cache.set('enero', {(2025, 1)}, 'viejo', generation)
+    cache.set('febrero', {(2025, 2)}, 'vigente', generation)
+    cache.set('todos', None, 'viejo', generation)
+
+    assert cache.get('enero') is None
+    assert cache.get('febrero') == 'vigente'
+    assert cache.get('todos') is None
+
+    generation = cache.generation()
+    cache.set('enero', {(2025, 1)}, 'nuevo', generation)
+    assert cache.get('enero') == 'nuevo'
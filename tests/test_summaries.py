@@ -0,0 +1,60 @@
+import sqlite3
+from datetime import datetime
+
+from benchmark import generate_egresos
+from db import SQLiteBackend, ensure_schema, normalize_types, partitions, replace_partitions
+from registry import delete_load, ensure_registry, register_load
+from summaries import SUMMARIES, ensure_summaries, update_summaries
+from transform import transform_dataframe
+from validation import validate_dataframe
+
+
+def _transformado(n, mes, seed):
+    df, _ = validate_dataframe(generate_egresos(n, mes=mes, seed=seed))
+    return normalize_types(transform_dataframe(df))
+
+
+# Carga por el mismo camino que run_upload: reemplazo, resúmenes y registro en una transacción
+def _cargar(backend, conn, carga_id, df):
+    def registrar(cursor, rows, replaced):
+        update_summaries(backend, conn, df)
+        register_load(cursor, carga_id, f'{carga_id}.csv', carga_id, partitions(df), rows,
+                      sum(replaced.values()), datetime.now(), datetime.now())
+
+    replace_partitions(backend, conn, df, before_commit=registrar)
+
+
+# Cada tabla de resumen debe coincidir con el GROUP BY equivalente sobre egresos
+def _assert_consistentes(conn):
+    for summary, dimensiones in SUMMARIES.items():
+        group_str = ', '.join(['anio', 'mes'] + dimensiones)
+        esperado = conn.execute(f"SELECT {group_str}, COUNT(*), COUNT(DISTINCT numhc) FROM egresos "
+                                f"GROUP BY {group_str}").fetchall()
+        actual = conn.execute(f"SELECT {group_str}, casos, pacientes FROM {summary}").fetchall()
+        assert sorted(actual, key=repr) == sorted(esperado, key=repr), summary
+
+
+def test_summaries_follow_loads_replaces_and_deletes():
+    backend = SQLiteBackend(':memory:')
+    conn = sqlite3.connect(':memory:')
+    ensure_schema(backend, conn)
+    ensure_registry(backend, conn)
+    # Datos cargados antes de que existieran las tablas de resumen: se llenan al crearlas
+    replace_partitions(backend, conn, _transformado(150, 3, seed=0))
+    ensure_summaries(backend, conn)
+    _assert_consistentes(conn)
+
+    _cargar(backend, conn, 'enero', _transformado(200, 1, seed=1))
+    _cargar(backend, conn, 'febrero', _transformado(120, 2, seed=2))
+    _assert_consistentes(conn)
+
+    # Reemplazo de enero con otro contenido
+    _cargar(backend, conn, 'enero_v2', _transformado(80, 1, seed=3))
+    _assert_consistentes(conn)
+    assert conn.execute("SELECT casos FROM resumen_mes WHERE anio = 2025 AND mes = 1").fetchone()[0] == \
+        conn.execute("SELECT COUNT(*) FROM egresos WHERE anio = 2025 AND mes = 1").fetchone()[0]
+
+    delete_load(backend, conn, 'enero_v2')
+    _assert_consistentes(conn)
+    assert conn.execute("SELECT COUNT(*) FROM resumen_diag WHERE anio = 2025 AND mes = 1").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM resumen_mes WHERE mes = 2").fetchone()[0] == 1
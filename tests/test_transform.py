@@ -0,0 +1,156 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from benchmark import generate_egresos, write_workbook
+from transform import (base_cols, columnas_orden, columnas_salida, cpt_cols, diag_cols, morb_cols,
+                       transform_dataframe, transform_excel_chunks, write_transformed_csv)
+from validation import validate_dataframe
+
+
+# Libro sin registro <dimension> (escrito en modo write_only): las filas cuyas últimas
+# celdas están vacías llegan más cortas que el encabezado en el modo de solo lectura
+@pytest.mark.parametrize('chunk_size', [10, 49, 1000])
+def test_chunks_without_dimension_record(tmp_path, chunk_size):
+    path = tmp_path / 'egresos.xlsx'
+    write_workbook(generate_egresos(200), path)
+
+    salida = tmp_path / 'salida.csv'
+    row_count = write_transformed_csv(transform_excel_chunks(path, chunk_size), salida)
+
+    df, _ = validate_dataframe(pd.read_excel(path))
+    esperado = transform_dataframe(df)
+    assert row_count == len(esperado)
+    # Mismo contenido y orden; la única diferencia es que los enteros con vacíos se
+    # escriben sin '.0' en el modo por lotes (Int64), por eso no se comparan los tipos
+    pd.testing.assert_frame_equal(pd.read_csv(salida), pd.read_csv(io.StringIO(esperado.to_csv(index=False))),
+                                  check_dtype=False)
+    with open(salida, encoding='utf-8') as f:
+        assert '.0,' not in f.read()
+
+
+# pd.read_excel lee la primera hoja aunque el libro se haya guardado con otra seleccionada
+def test_chunks_read_first_sheet(tmp_path):
+    path = tmp_path / 'egresos.xlsx'
+    with pd.ExcelWriter(path) as writer:
+        generate_egresos(30).to_excel(writer, sheet_name='egresos', index=False)
+        pd.DataFrame({'nota': ['otra hoja']}).to_excel(writer, sheet_name='notas', index=False)
+    wb = load_workbook(path)
+    wb.active = 1
+    wb.save(path)
+
+    filas = sum(len(chunk) for chunk in transform_excel_chunks(path, 10))
+
+    df, _ = validate_dataframe(pd.read_excel(path))
+    assert filas == len(transform_dataframe(df))
+
+
+# Sin filas válidas el CSV sin ordenar igual lleva encabezado y se puede volver a leer
+def test_unsorted_csv_without_rows_has_header(tmp_path):
+    salida = tmp_path / 'salida.csv'
+
+    assert write_transformed_csv(iter([]), salida, ordenar=False) == 0
+    assert list(pd.read_csv(salida).columns) == columnas_salida
+
+
+# Implementación original fila a fila (iterrows), como referencia de la vectorizada
+def _transform_iterrows(df):
+    df['fecegr'] = pd.to_datetime(df['fecegr'], format='%m/%d/%y', errors='coerce')
+    df['anio'] = df['fecegr'].dt.year
+    df['mes'] = df['fecegr'].dt.month
+
+    def calcular_idetareo(fila):
+        edad = fila['edad']
+        if edad <= 11:
+            return 1
+        elif 12 <= edad <= 17:
+            return 2
+        elif 18 <= edad <= 29:
+            return 3
+        else:
+            return 4
+
+    df['idetareo'] = df.apply(calcular_idetareo, axis=1)
+
+    rows = []
+    for idx, row in df.iterrows():
+        for i, diag_col in enumerate(diag_cols, 1):
+            diag = row[diag_col]
+            if pd.notna(diag) and diag != '':
+                cemorb = ''
+                numcemorb = 0
+                if i == 1 and len(morb_cols) > 0:
+                    cemorb = row[morb_cols[0]] if pd.notna(row[morb_cols[0]]) and row[morb_cols[0]] != '' else ''
+                    numcemorb = 1 if cemorb else 0
+                elif i == 2 and len(morb_cols) > 1:
+                    cemorb = row[morb_cols[1]] if pd.notna(row[morb_cols[1]]) and row[morb_cols[1]] != '' else ''
+                    numcemorb = 2 if cemorb else 0
+
+                codcpt = row[cpt_cols[i-1]] if i-1 < len(cpt_cols) and pd.notna(row[cpt_cols[i-1]]) and row[cpt_cols[i-1]] != '' else ''
+                numcodcpt = i if codcpt else 0
+
+                new_row = {col: row[col] for col in base_cols}
+                new_row.update({
+                    'diag': diag,
+                    'numdiag': i,
+                    'cemorb': cemorb,
+                    'numcemorb': numcemorb,
+                    'codcpt': codcpt,
+                    'numcodcpt': numcodcpt
+                })
+                rows.append(new_row)
+
+    df_final = pd.DataFrame(rows)
+    df_final['diag'] = df_final['diag'].fillna('')
+    df_final['cemorb'] = df_final['cemorb'].fillna('')
+    df_final['codcpt'] = df_final['codcpt'].fillna('')
+    df_final['numdiag'] = df_final['numdiag'].fillna(0).astype(int)
+    df_final['numcemorb'] = df_final['numcemorb'].fillna(0).astype(int)
+    df_final['numcodcpt'] = df_final['numcodcpt'].fillna(0).astype(int)
+    df_final = df_final[columnas_salida]
+    return df_final.sort_values(by=columnas_orden)
+
+
+# Casos límite: diagnósticos vacíos ('' y NaN), edad vacía y fuera de los tramos enteros,
+# cemorb/codcpt vacíos, filas sin ningún diagnóstico y nombres repetidos
+def _egresos_limite():
+    nan = np.nan
+    filas = [
+        # edad, coddiag1..4, cemorb1, cemorb2, codcpt1..4, nomb
+        (5, 'A01', '', 'B02', nan, 'M1', '', 'C1', nan, '', 'C4', 'ANA'),
+        (nan, '', nan, nan, 'D04', nan, 'M2', '', 'C2', 'C3', 'C4', 'LUIS'),
+        (15, nan, nan, nan, nan, 'M1', 'M2', 'C1', nan, nan, nan, 'SIN'),
+        (11.5, 'E01', 'E02', 'E03', 'E04', '', 'M2', '', '', '', '', 'ANA'),
+        (29, '', '', '', '', nan, nan, nan, nan, nan, nan, 'VACIO'),
+        (30, 'F01', nan, '', nan, nan, nan, 'C1', 'C2', nan, nan, 'BETO'),
+        (18, 'G01', 'G02', nan, nan, 'M1', nan, nan, 'C2', nan, nan, 'ANA'),
+    ]
+    columnas = ['edad'] + diag_cols + morb_cols + cpt_cols + ['nomb']
+    df = pd.DataFrame(filas, columns=columnas).astype({col: object for col in columnas if col != 'edad'})
+    n = len(df)
+    df['fecegr'] = ['01/15/25'] * (n - 1) + ['02/03/25']
+    df['numhc'] = np.arange(100, 100 + n)
+    df['doc_iden'] = [f'{70000000 + i}' for i in range(n)]
+    df['etnia'] = 80
+    df['sexo'] = ['M', 'F'] * (n // 2) + ['M'] * (n % 2)
+    df['tipoedad'] = 1
+    df['ups'] = 301200
+    df['totalest'] = np.arange(1, n + 1)
+    df['apell'] = 'PEREZ'
+    df['ubigeo'] = 150101
+    df['condicion'] = 1
+    return df
+
+
+def test_vectorized_matches_iterrows():
+    esperado = _transform_iterrows(_egresos_limite())
+    resultado = transform_dataframe(_egresos_limite())
+
+    # La referencia reconstruye el DataFrame desde diccionarios y vuelve a inferir los
+    # tipos (int64 y str en lugar de int32 de .dt y object); se comparan los valores
+    assert len(resultado) == 10
+    pd.testing.assert_frame_equal(resultado.reset_index(drop=True), esperado.reset_index(drop=True),
+                                  check_dtype=False)
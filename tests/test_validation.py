@@ -0,0 +1,39 @@
+import pandas as pd
+
+from benchmark import generate_egresos
+from db import normalize_types
+from validation import validate_dataframe
+
+
+# Una edad con decimales no se puede guardar en la columna INTEGER: la fila se rechaza
+# con su motivo en lugar de hacer fallar la subida completa
+def test_fractional_integer_rejected():
+    df = generate_egresos(5).astype({'edad': object})
+    df.loc[2, 'edad'] = 1.5
+    df.loc[3, 'edad'] = '7.25'
+
+    validas, rechazos = validate_dataframe(df)
+
+    assert list(validas.index) == [0, 1, 4]
+    assert rechazos[['fila', 'columna', 'valor']].values.tolist() == [[4, 'edad', '1.5'], [5, 'edad', '7.25']]
+    assert (rechazos['motivo'] == 'número con decimales en una columna entera').all()
+    edad = normalize_types(validas[['edad']].copy())['edad']
+    assert edad.dtype == 'Int64'
+    assert edad.tolist() == pd.Series(validas['edad'], dtype='Int64').tolist()
+
+
+# Texto en una columna entera se guardaría como NULL: la fila se rechaza; las celdas
+# vacías (o con espacios) se aceptan
+def test_text_in_integer_column_rejected():
+    df = generate_egresos(5).astype({'sexo': object, 'ups': object})
+    df.loc[1, 'sexo'] = 'M'
+    df.loc[3, 'ups'] = 'UCI'
+    df.loc[4, 'ups'] = ' '
+
+    validas, rechazos = validate_dataframe(df)
+
+    assert list(validas.index) == [0, 2, 4]
+    assert rechazos[['fila', 'columna', 'valor', 'motivo']].values.tolist() == [
+        [3, 'sexo', 'M', 'texto no numérico en una columna entera'],
+        [5, 'ups', 'UCI', 'texto no numérico en una columna entera'],
+    ]
@@ -1,95 +1,355 @@
+import csv
+import heapq
+import os
+import tempfile
+import warnings
+from itertools import islice
+
+import numpy as np
 import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+import cache
+from instrumentation import phase_timer
+from validation import REJECTION_COLUMNS, validate_dataframe
+
+# Los libros exportados por el sistema de egresos no traen estilo por defecto y openpyxl
+# lo avisa en cada lectura; las demás advertencias se dejan ver
+warnings.filterwarnings('ignore', message='Workbook contains no default style', category=UserWarning)
+
+# Versión de la transformación: cambiarla invalida las salidas guardadas en caché
+TRANSFORM_VERSION = 5
+
+# Nombre del DataFrame binario (parquet o pickle) que acompaña a la salida de cada
+# trabajo, para que la subida a la base de datos no vuelva a leer el CSV/XLSX
+FRAME_SIDECAR = 'egresos_transformado'
+
+# Informe de filas rechazadas por la validación (fila del Excel, columna, valor, motivo)
+REJECTION_REPORT = 'rechazos.csv'
+
+# Definir columnas para diagnósticos, morbilidades y códigos CPT
+diag_cols = ['coddiag1', 'coddiag2', 'coddiag3', 'coddiag4']
+morb_cols = ['cemorb1', 'cemorb2']
+cpt_cols = ['codcpt1', 'codcpt2', 'codcpt3', 'codcpt4']
+base_cols = ['anio', 'mes', 'numhc', 'doc_iden', 'etnia', 'sexo', 'edad', 'tipoedad', 'idetareo',
+             'ups', 'totalest', 'nomb', 'apell', 'ubigeo', 'condicion']
+
+# Seleccionar y ordenar las columnas para el formato final
+columnas_salida = [
+    'anio', 'mes', 'numhc', 'doc_iden', 'etnia', 'sexo', 'edad', 'tipoedad', 'idetareo',
+    'ups', 'diag', 'numdiag', 'cemorb', 'numcemorb', 'codcpt', 'numcodcpt', 'totalest',
+    'nomb', 'apell', 'ubigeo', 'condicion'
+]
+
+# Ordenar por nomb, apell, numdiag, numcemorb, numcodcpt
+columnas_orden = ['nomb', 'apell', 'numdiag', 'numcemorb', 'numcodcpt']
+
+
+# Calcular idetareo basado en edad (asumiendo tipoedad=1 significa años)
+# Categorías: 1: 0-11 años, 2: 12-17 años, 3: 18-29 años, 4: 30+ años (y edad vacía)
+def calcular_idetareo(edad):
+    edad = pd.to_numeric(edad)
+    condiciones = [
+        edad <= 11,
+        (edad >= 12) & (edad <= 17),
+        (edad >= 18) & (edad <= 29),
+    ]
+    return np.select(condiciones, [1, 2, 3], default=4)
+
+
+# Máscara de celdas con código: ni NaN ni cadena vacía
+def _celdas_con_valor(valores):
+    return pd.notna(valores) & (valores != '')
+
+
+# Valor de la celda si tiene código, '' en caso contrario
+def _codigos(valores):
+    return np.where(_celdas_con_valor(valores), valores, '')
+
+
+# Número de la posición (1..4) si el código no está vacío, 0 en caso contrario
+def _numeros(codigos, numero):
+    return np.where(codigos.astype(bool), numero, 0)
+
 
 def transform_excel(file_path):
-    # Leer el archivo Excel
+    # Leer el archivo Excel y descartar las filas que no pasan la validación
     df = pd.read_excel(file_path)
+    df, _ = validate_dataframe(df)
+    return transform_dataframe(df)
+
 
+def transform_dataframe(df, ordenar=True):
     # Extraer año y mes de la columna fecegr
     df['fecegr'] = pd.to_datetime(df['fecegr'], format='%m/%d/%y', errors='coerce')
     df['anio'] = df['fecegr'].dt.year
     df['mes'] = df['fecegr'].dt.month
 
-    # Calcular idetareo basado en edad (asumiendo tipoedad=1 significa años)
-    def calcular_idetareo(fila):
-        edad = fila['edad']
-        if edad <= 11:
-            return 1
-        elif 12 <= edad <= 17:
-            return 2
-        elif 18 <= edad <= 29:
-            return 3
-        else:
-            return 4
-        
     # ahora quiero que coloques algunas restricciones al momento de subir un archivo a la base de datos
     # por ejemplo: 
     # 1.- al momento de subir el primer archivo transformado a la base de datos quiero que me vote un mensaje que indique que se subio satisfactoriamente y la cantidad de registros 
     # 2.- al momento de subir el siguiente archivo quiero si se vuelve a subir el mismo archivo transformado quiero que vote una restriccion que indique que ya se subio ya que los registros son iguales, entonces no deberia de poder subirse
     # 3.- quiero q crees una interfaz en el html donde se pueda ver todos los registros subidos, x ejemplo egresos enero 2025, egresos febrero 2025, etc y haya la opcion de eliminar el registro que yo quiera por que talvez hay un error en los registros, entonces solo lo elimino y lo vuelvo a subir con los registros corregidos. 
 
-    df['idetareo'] = df.apply(calcular_idetareo, axis=1)
-
-
-
-    # Definir columnas para diagnósticos, morbilidades y códigos CPT
-    diag_cols = ['coddiag1', 'coddiag2', 'coddiag3', 'coddiag4']
-    morb_cols = ['cemorb1', 'cemorb2']
-    cpt_cols = ['codcpt1', 'codcpt2', 'codcpt3', 'codcpt4']
-    base_cols = ['anio', 'mes', 'numhc', 'doc_iden', 'etnia', 'sexo', 'edad', 'tipoedad', 'idetareo', 
-                 'ups', 'totalest', 'nomb', 'apell', 'ubigeo', 'condicion']
-
-    # Crear filas para cada diagnóstico, incluyendo cemorb y codcpt correspondientes
-    rows = []
-    for idx, row in df.iterrows():
-        for i, diag_col in enumerate(diag_cols, 1):
-            diag = row[diag_col]
-            if pd.notna(diag) and diag != '':
-                # Obtener cemorb correspondiente (si existe)
-                cemorb = ''
-                numcemorb = 0
-                if i == 1 and len(morb_cols) > 0:
-                    cemorb = row[morb_cols[0]] if pd.notna(row[morb_cols[0]]) and row[morb_cols[0]] != '' else ''
-                    numcemorb = 1 if cemorb else 0
-                elif i == 2 and len(morb_cols) > 1:
-                    cemorb = row[morb_cols[1]] if pd.notna(row[morb_cols[1]]) and row[morb_cols[1]] != '' else ''
-                    numcemorb = 2 if cemorb else 0
-
-                # Obtener codcpt correspondiente (si existe)
-                codcpt = row[cpt_cols[i-1]] if i-1 < len(cpt_cols) and pd.notna(row[cpt_cols[i-1]]) and row[cpt_cols[i-1]] != '' else ''
-                numcodcpt = i if codcpt else 0
-
-                # Crear fila con todos los datos
-                new_row = {col: row[col] for col in base_cols}
-                new_row.update({
-                    'diag': diag,
-                    'numdiag': i,
-                    'cemorb': cemorb,
-                    'numcemorb': numcemorb,
-                    'codcpt': codcpt,
-                    'numcodcpt': numcodcpt
-                })
-                rows.append(new_row)
-
-    # Convertir las filas en un DataFrame
-    df_final = pd.DataFrame(rows)
-
-    # Reemplazar NaN en columnas específicas con valores vacíos o 0
-    df_final['diag'] = df_final['diag'].fillna('')
-    df_final['cemorb'] = df_final['cemorb'].fillna('')
-    df_final['codcpt'] = df_final['codcpt'].fillna('')
-    df_final['numdiag'] = df_final['numdiag'].fillna(0).astype(int)
-    df_final['numcemorb'] = df_final['numcemorb'].fillna(0).astype(int)
-    df_final['numcodcpt'] = df_final['numcodcpt'].fillna(0).astype(int)
-
-    # Seleccionar y ordenar las columnas para el formato final
-    columnas_salida = [
-        'anio', 'mes', 'numhc', 'doc_iden', 'etnia', 'sexo', 'edad', 'tipoedad', 'idetareo',
-        'ups', 'diag', 'numdiag', 'cemorb', 'numcemorb', 'codcpt', 'numcodcpt', 'totalest',
-        'nomb', 'apell', 'ubigeo', 'condicion'
-    ]
+    df['idetareo'] = calcular_idetareo(df['edad'])
+
+    # Matrices (filas x posición) de diagnósticos, cemorb y codcpt. El cemorb solo
+    # acompaña a los diagnósticos 1 y 2; las posiciones 3 y 4 quedan vacías.
+    n = len(df)
+    diags = df[diag_cols].to_numpy(dtype=object)
+    cemorbs = np.full((n, len(diag_cols)), '', dtype=object)
+    cemorbs[:, :len(morb_cols)] = _codigos(df[morb_cols].to_numpy(dtype=object))
+    codcpts = _codigos(df[cpt_cols].to_numpy(dtype=object))
+    posiciones = np.arange(1, len(diag_cols) + 1)
+
+    # Apilar por fila (fila 0 diag 1..4, fila 1 diag 1..4, ...) y quedarse con
+    # las celdas que tienen diagnóstico, igual que el recorrido fila a fila
+    mascara = _celdas_con_valor(diags).ravel()
+    filas = np.repeat(np.arange(n), len(diag_cols))[mascara]
+    numdiag = np.tile(posiciones, n)[mascara]
+    cemorb = cemorbs.ravel()[mascara]
+    codcpt = codcpts.ravel()[mascara]
+
+    df_final = df[base_cols].iloc[filas].reset_index(drop=True)
+    df_final['diag'] = pd.Series(diags.ravel()[mascara], dtype=object).infer_objects()
+    df_final['numdiag'] = numdiag.astype(int)
+    df_final['cemorb'] = pd.Series(cemorb, dtype=object).infer_objects()
+    df_final['numcemorb'] = _numeros(cemorb, numdiag).astype(int)
+    df_final['codcpt'] = pd.Series(codcpt, dtype=object).infer_objects()
+    df_final['numcodcpt'] = _numeros(codcpt, numdiag).astype(int)
+
     df_final = df_final[columnas_salida]
 
     # Ordenar por nomb, apell, numdiag, numcemorb, numcodcpt
-    df_final = df_final.sort_values(by=['nomb', 'apell', 'numdiag', 'numcemorb', 'numcodcpt'])
+    if ordenar:
+        df_final = df_final.sort_values(by=columnas_orden)
+
+    return df_final
+
 
-    return df_final
\ No newline at end of file
+# Leer el Excel por lotes de filas sin cargar el libro completo (openpyxl en modo solo lectura)
+def iter_excel_chunks(file_path, chunk_size=50000):
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        # La primera hoja, igual que pd.read_excel (wb.active es la que quedó seleccionada)
+        ws = wb.worksheets[0]
+        # Sin registro <dimension> (libros generados por otras herramientas) el modo de solo
+        # lectura devuelve cada fila solo hasta su última celda escrita; se recalculan las
+        # dimensiones y las filas se leen con el ancho del encabezado.
+        ws.reset_dimensions()
+        encabezado = next(ws.iter_rows(max_row=1, values_only=True), None)
+        if encabezado is None:
+            return
+        ancho = len(encabezado)
+        filas = (fila + (None,) * (ancho - len(fila)) for fila in ws.iter_rows(min_row=2, max_col=ancho, values_only=True))
+        # Las filas totalmente vacías no generan diagnósticos, se descartan. El índice de
+        # cada lote es el de read_excel (fila del Excel - 2) para que los rechazos indiquen
+        # la fila correcta.
+        filas = ((i, fila) for i, fila in enumerate(filas) if any(valor is not None for valor in fila))
+        while True:
+            lote = list(islice(filas, chunk_size))
+            if not lote:
+                break
+            yield pd.DataFrame([fila for _, fila in lote], columns=encabezado, index=[i for i, _ in lote])
+    finally:
+        wb.close()
+
+
+# Cada lote infiere sus propios tipos: una columna entera con vacíos sería float
+# en un lote (18.0) e int en otro (18). Se fijan como enteros anulables (Int64)
+# para que todos los lotes se escriban igual.
+def _enteros_estables(df_chunk):
+    for col in df_chunk.columns:
+        serie = df_chunk[col]
+        if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+            df_chunk[col] = serie.astype('Int64')
+    return df_chunk
+
+
+# Transformar el Excel lote por lote; cada lote se devuelve sin ordenar. Los rechazos de
+# la validación de cada lote se agregan a la lista rechazos (si se pasa)
+def transform_excel_chunks(file_path, chunk_size=50000, rechazos=None):
+    contexto = {}
+    for chunk in iter_excel_chunks(file_path, chunk_size):
+        chunk, rechazos_lote = validate_dataframe(chunk, contexto=contexto)
+        if rechazos is not None and len(rechazos_lote):
+            rechazos.append(rechazos_lote)
+        df_chunk = transform_dataframe(chunk, ordenar=False)
+        if len(df_chunk):
+            yield _enteros_estables(df_chunk)
+
+
+# Clave de orden equivalente a sort_values sobre las filas leídas de un CSV:
+# los vacíos (NaN) van al final y numdiag/numcemorb/numcodcpt son enteros
+def _clave_orden(posiciones):
+    def clave(fila):
+        nomb, apell, numdiag, numcemorb, numcodcpt = (fila[i] for i in posiciones)
+        return (nomb == '', nomb, apell == '', apell, int(numdiag), int(numcemorb), int(numcodcpt))
+    return clave
+
+
+# Escribir los lotes transformados en un CSV. Con ordenar=True cada lote se ordena
+# y se guarda como corrida temporal, y luego se mezclan las corridas (merge externo),
+# de modo que la memoria depende del tamaño del lote y no del archivo.
+def write_transformed_csv(chunks, output_path, ordenar=True):
+    row_count = 0
+    if not ordenar:
+        # El encabezado se escribe aunque no haya filas válidas, para que el CSV se pueda leer
+        with open(output_path, 'w', encoding='utf-8', newline='') as salida:
+            csv.writer(salida, lineterminator='\n').writerow(columnas_salida)
+            for chunk in chunks:
+                chunk.to_csv(salida, index=False, header=False)
+                row_count += len(chunk)
+        return row_count
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as tmp_dir:
+        corridas = []
+        for i, chunk in enumerate(chunks):
+            corrida = os.path.join(tmp_dir, f'corrida_{i}.csv')
+            chunk.sort_values(by=columnas_orden).to_csv(corrida, index=False, encoding='utf-8')
+            corridas.append(corrida)
+            row_count += len(chunk)
+
+        archivos = [open(corrida, encoding='utf-8', newline='') for corrida in corridas]
+        try:
+            lectores = [csv.reader(archivo) for archivo in archivos]
+            for lector in lectores:
+                next(lector)
+            clave = _clave_orden([columnas_salida.index(col) for col in columnas_orden])
+            with open(output_path, 'w', encoding='utf-8', newline='') as salida:
+                escritor = csv.writer(salida, lineterminator='\n')
+                escritor.writerow(columnas_salida)
+                escritor.writerows(heapq.merge(*lectores, key=clave))
+        finally:
+            for archivo in archivos:
+                archivo.close()
+    return row_count
+
+
+# XLSX en modo write-only de openpyxl: las filas se escriben por lotes sin mantener las
+# celdas en memoria (más rápido que to_excel, que arma la hoja completa)
+def write_xlsx(df, output_path, chunk_rows=10000):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(df.columns))
+    for start in range(0, len(df), chunk_rows):
+        lote = df.iloc[start:start + chunk_rows].astype(object)
+        lote = lote.where(lote.notna(), None)
+        for fila in lote.itertuples(index=False, name=None):
+            ws.append(fila)
+    wb.save(output_path)
+
+
+# Guardar el DataFrame binario para la subida a la base de datos y la salida en el
+# formato pedido. Con write_file=False se omite el CSV (/download lo genera al vuelo);
+# el XLSX se escribe siempre aquí, fuera del hilo de la solicitud.
+def _write_output(df_final, output_folder, output_path, output_format, write_file=True):
+    cache.store(output_folder, FRAME_SIDECAR, df_final)
+    if output_format == 'xlsx':
+        write_xlsx(df_final, output_path)
+    elif write_file:
+        df_final.to_csv(output_path, index=False, encoding='utf-8')
+
+
+# Guardar el informe de rechazos en la carpeta del trabajo; devuelve su nombre (None si no hubo)
+def write_rejection_report(rechazos, output_folder):
+    if not len(rechazos):
+        return None
+    rechazos.to_csv(os.path.join(output_folder, REJECTION_REPORT), index=False, encoding='utf-8')
+    return REJECTION_REPORT
+
+
+# Indicar si la salida de un trabajo sigue disponible (DataFrame binario o archivo)
+def output_exists(output_folder, transformed_filename):
+    return cache.exists(output_folder, FRAME_SIDECAR) or os.path.exists(os.path.join(output_folder, transformed_filename))
+
+
+# Leer la salida de un trabajo: el DataFrame binario si existe, o el CSV/XLSX
+def load_output(output_folder, transformed_filename):
+    df = cache.load(output_folder, FRAME_SIDECAR)
+    if df is not None:
+        return df
+    file_path = os.path.join(output_folder, transformed_filename)
+    if transformed_filename.endswith('.xlsx'):
+        return pd.read_excel(file_path)
+    return pd.read_csv(file_path)
+
+
+# Tarea completa de /transform: leer, validar, transformar y guardar la salida en output_folder
+# (carpeta propia del trabajo) junto con el DataFrame binario FRAME_SIDECAR. Las filas
+# inválidas no pasan a la salida y quedan en el informe REJECTION_REPORT.
+# progress(phase=..., rows=...) informa el avance. Elimina el archivo subido al terminar.
+# cache_options ({'folder', 'max_bytes', 'max_age'}) activa el caché de salidas por hash
+# del archivo: si el mismo libro ya se transformó solo se escribe el formato pedido.
+# Con write_file=False no se escribe el CSV, solo el DataFrame binario (el XLSX siempre).
+def run_transform(progress, file_path, output_folder, output_format='csv', streaming=False, chunk_size=50000, ordenar=True, cache_options=None, write_file=True):
+    try:
+        if output_format == 'xlsx':
+            transformed_filename = 'egresos_transformado.xlsx'
+            mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        else:
+            transformed_filename = 'egresos_transformado.csv'
+            mime_type = 'text/csv'
+        output_path = os.path.join(output_folder, transformed_filename)
+
+        df_final = None
+        rechazos = None
+        key = None
+        timings = {}
+        if cache_options:
+            progress(phase='buscando en caché')
+            with phase_timer(timings, 'cache'):
+                key = cache.file_key(file_path, TRANSFORM_VERSION)
+                df_final = cache.load(cache_options['folder'], key)
+                rechazos = cache.load(cache_options['folder'], f'{key}_rechazos')
+
+        if df_final is not None and rechazos is not None:
+            row_count = len(df_final)
+            progress(phase='guardando', rows=row_count)
+            with phase_timer(timings, 'serialize'):
+                _write_output(df_final, output_folder, output_path, output_format, write_file)
+                report = write_rejection_report(rechazos, output_folder)
+            return {'filename': transformed_filename, 'mime_type': mime_type, 'rows': row_count, 'cached': True, 'frame': True,
+                    'rejected_rows': int(rechazos['fila'].nunique()), 'report': report, 'timings': timings}
+
+        if output_format != 'xlsx' and streaming and file_path.endswith('.xlsx'):
+            # Modo por lotes: el libro se lee y transforma por bloques de filas sin cargarlo completo
+            partes = []
+            def chunks_con_progreso():
+                rows = 0
+                for chunk in transform_excel_chunks(file_path, chunk_size, partes):
+                    rows += len(chunk)
+                    progress(phase='transformando', rows=rows)
+                    yield chunk
+            progress(phase='transformando')
+            # Lectura, validación, transformación y escritura van intercaladas: una sola fase
+            with phase_timer(timings, 'streaming_transform'):
+                row_count = write_transformed_csv(chunks_con_progreso(), output_path, ordenar=ordenar)
+            rechazos = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=REJECTION_COLUMNS)
+            return {'filename': transformed_filename, 'mime_type': mime_type, 'rows': row_count, 'cached': False, 'frame': False,
+                    'rejected_rows': int(rechazos['fila'].nunique()), 'report': write_rejection_report(rechazos, output_folder), 'timings': timings}
+        else:
+            progress(phase='leyendo')
+            with phase_timer(timings, 'read'):
+                df = pd.read_excel(file_path)
+            progress(phase='validando', rows=len(df))
+            with phase_timer(timings, 'validate'):
+                df, rechazos = validate_dataframe(df)
+            progress(phase='transformando', rows=len(df))
+            with phase_timer(timings, 'transform'):
+                df_final = transform_dataframe(df)
+            row_count = len(df_final)
+            if key is not None:
+                with phase_timer(timings, 'cache'):
+                    cache.store(cache_options['folder'], key, df_final)
+                    cache.store(cache_options['folder'], f'{key}_rechazos', rechazos)
+                    cache.evict(cache_options['folder'], cache_options['max_bytes'], cache_options['max_age'])
+            progress(phase='guardando', rows=row_count)
+            with phase_timer(timings, 'serialize'):
+                _write_output(df_final, output_folder, output_path, output_format, write_file)
+                report = write_rejection_report(rechazos, output_folder)
+        return {'filename': transformed_filename, 'mime_type': mime_type, 'rows': row_count, 'cached': False, 'frame': True,
+                'rejected_rows': int(rechazos['fila'].nunique()), 'report': report, 'timings': timings}
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
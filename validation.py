@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+# Columnas que debe traer el Excel de egresos; si falta alguna no se puede transformar
+REQUIRED_COLUMNS = [
+    'fecegr', 'numhc', 'doc_iden', 'etnia', 'sexo', 'edad', 'tipoedad', 'ups', 'totalest',
+    'nomb', 'apell', 'ubigeo', 'condicion',
+    'coddiag1', 'coddiag2', 'coddiag3', 'coddiag4', 'cemorb1', 'cemorb2',
+    'codcpt1', 'codcpt2', 'codcpt3', 'codcpt4',
+]
+
+# Formato de fecegr en el Excel (mm/dd/aa)
+FECHA_FORMATO = '%m/%d/%y'
+
+# Forma de un código CIE-10: letra, dos dígitos y hasta cuatro caracteres más (con o sin punto)
+CIE10 = r'[A-Z][0-9]{2}(\.?[0-9A-Z]{1,4})?'
+
+# Reglas por columna, en orden. Cada regla marca filas inválidas con su motivo:
+# - fecha: la columna debe tener una fecha con el formato dado (se convierte a fecha)
+# - numero: la celda debe ser numérica; vacío (o solo espacios) permitido
+# - entero: un número sin decimales (la columna se guarda como INTEGER); vacío permitido.
+#   El texto no numérico lo rechaza antes la regla numero de la misma columna
+# - rango: número entre min y max (None = sin límite). 'cuando' limita la regla a las
+#   filas donde otra columna tiene un valor (edad en años si tipoedad = 1)
+# - cie10: código con forma CIE-10; vacío permitido
+# - periodo_unico: el anio/mes de fecegr debe ser el mismo en todo el archivo
+RULES = [
+    {'check': 'fecha', 'columns': ['fecegr'], 'format': FECHA_FORMATO, 'motivo': 'fecha de egreso vacía o con formato distinto de mm/dd/aa'},
+    {'check': 'numero', 'columns': ['edad'], 'motivo': 'edad no numérica'},
+    {'check': 'numero', 'columns': ['doc_iden', 'etnia', 'sexo', 'tipoedad', 'ups', 'totalest', 'ubigeo', 'condicion'],
+     'motivo': 'texto no numérico en una columna entera'},
+    {'check': 'entero', 'columns': ['doc_iden', 'etnia', 'sexo', 'edad', 'tipoedad', 'ups', 'totalest', 'ubigeo', 'condicion'],
+     'motivo': 'número con decimales en una columna entera'},
+    {'check': 'rango', 'columns': ['edad'], 'min': 0, 'max': None, 'motivo': 'edad negativa'},
+    {'check': 'rango', 'columns': ['edad'], 'min': 0, 'max': 120, 'cuando': ('tipoedad', 1), 'motivo': 'edad en años fuera de 0-120'},
+    {'check': 'cie10', 'columns': ['coddiag1', 'coddiag2', 'coddiag3', 'coddiag4', 'cemorb1', 'cemorb2'], 'motivo': 'código sin forma CIE-10'},
+    {'check': 'periodo_unico', 'columns': ['fecegr'], 'motivo': 'anio/mes distinto al del resto del archivo'},
+]
+
+REJECTION_COLUMNS = ['fila', 'columna', 'valor', 'motivo']
+
+
+class ValidationError(ValueError):
+    pass
+
+
+def _check_fecha(df, column, rule, contexto):
+    fechas = pd.to_datetime(df[column], format=rule['format'], errors='coerce')
+    df[column] = fechas
+    return fechas.isna().to_numpy()
+
+
+def _check_numero(df, column, rule, contexto):
+    serie = df[column]
+    if pd.api.types.is_numeric_dtype(serie):
+        return np.zeros(len(df), dtype=bool)
+    vacia = serie.isna() | serie.astype(str).str.strip().eq('')
+    return (~vacia & pd.to_numeric(serie, errors='coerce').isna()).to_numpy(dtype=bool)
+
+
+def _check_entero(df, column, rule, contexto):
+    numeros = pd.to_numeric(df[column], errors='coerce')
+    return (numeros.notna() & (numeros % 1 != 0)).to_numpy(dtype=bool)
+
+
+def _check_rango(df, column, rule, contexto):
+    numeros = pd.to_numeric(df[column], errors='coerce')
+    invalida = np.zeros(len(df), dtype=bool)
+    if rule.get('min') is not None:
+        invalida |= (numeros < rule['min']).to_numpy()
+    if rule.get('max') is not None:
+        invalida |= (numeros > rule['max']).to_numpy()
+    if 'cuando' in rule:
+        otra, valor = rule['cuando']
+        invalida &= (pd.to_numeric(df[otra], errors='coerce') == valor).to_numpy()
+    return invalida
+
+
+# Los códigos se repiten mucho: se valida cada valor distinto una sola vez y solo si
+# alguno es inválido se buscan sus filas
+def _check_cie10(df, column, rule, contexto):
+    serie = df[column]
+    unicos = pd.Series(pd.unique(serie), dtype=object)
+    unicos = unicos[unicos.notna() & (unicos != '')]
+    validos = unicos.astype(str).str.strip().str.upper().str.fullmatch(CIE10).to_numpy(dtype=bool)
+    invalidos = unicos[~validos]
+    if not len(invalidos):
+        return np.zeros(len(df), dtype=bool)
+    return serie.isin(invalidos).to_numpy()
+
+
+# El periodo del archivo es el anio/mes más frecuente (o el ya fijado en contexto por un
+# lote anterior del mismo archivo)
+def _check_periodo_unico(df, column, rule, contexto):
+    fechas = df[column]
+    periodos = (fechas.dt.year * 100 + fechas.dt.month).to_numpy()
+    validos = ~np.isnan(periodos)
+    if not validos.any():
+        return np.zeros(len(df), dtype=bool)
+    if contexto.get('periodo') is None:
+        valores, cuentas = np.unique(periodos[validos], return_counts=True)
+        contexto['periodo'] = int(valores[np.argmax(cuentas)])
+    return validos & (periodos != contexto['periodo'])
+
+
+CHECKS = {
+    'fecha': _check_fecha,
+    'numero': _check_numero,
+    'entero': _check_entero,
+    'rango': _check_rango,
+    'cie10': _check_cie10,
+    'periodo_unico': _check_periodo_unico,
+}
+
+
+# Validar el Excel leído: aplica RULES con operaciones vectorizadas y separa las filas
+# inválidas. Devuelve (filas válidas, rechazos) donde rechazos tiene una fila por regla
+# incumplida (fila del Excel, columna, valor, motivo). fecegr queda convertida a fecha.
+# contexto (dict) conserva el periodo del archivo entre lotes del mismo archivo.
+def validate_dataframe(df, rules=RULES, contexto=None):
+    faltantes = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if faltantes:
+        raise ValidationError(f"Faltan columnas obligatorias en el archivo: {', '.join(faltantes)}")
+    contexto = {} if contexto is None else contexto
+
+    invalida = np.zeros(len(df), dtype=bool)
+    partes = []
+    for rule in rules:
+        for column in rule['columns']:
+            valores = df[column]
+            mascara = CHECKS[rule['check']](df, column, rule, contexto)
+            if mascara.any():
+                invalida |= mascara
+                partes.append(pd.DataFrame({
+                    # Fila del Excel: el índice empieza en 0 y la fila 1 es el encabezado
+                    'fila': df.index[mascara] + 2,
+                    'columna': column,
+                    'valor': valores[mascara].astype(object).where(valores[mascara].notna(), '').astype(str).to_numpy(),
+                    'motivo': rule['motivo'],
+                }))
+    if partes:
+        rechazos = pd.concat(partes, ignore_index=True).sort_values('fila', kind='stable', ignore_index=True)
+    else:
+        rechazos = pd.DataFrame(columns=REJECTION_COLUMNS)
+    return df[~invalida], rechazos
@@ -0,0 +1,15 @@
+# Entrada WSGI para gunicorn (la configuración está en gunicorn.conf.py):
+#
+#     gunicorn wsgi:app
+#
+# El estado de los trabajos en segundo plano (jobs._jobs) vive en la memoria del worker
+# que los creó, así que se usa un solo worker con varios hilos: con varios workers,
+# /jobs/<id>, /download y /upload_to_db podrían llegar a otro que no conoce el trabajo.
+# La transformación ya corre en el pool de procesos de ese worker.
+# Con preload este módulo se importa en el proceso maestro: warmup() carga ahí pandas,
+# openpyxl y los módulos de transformación, y el worker (también al reiniciarse) los
+# hereda al hacer fork. Los pools de trabajos y las conexiones se crean en el worker.
+from app import create_app, warmup
+
+app = create_app()
+warmup()